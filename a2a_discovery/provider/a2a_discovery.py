@@ -18,6 +18,12 @@ class A2aDiscoveryProvider(ToolProvider):
                 nacos_password = credentials.get("nacos_password")
                 nacos_access_key = credentials.get("nacos_accessKey")
                 nacos_secret_key = credentials.get("nacos_secretKey")
+                service_name_format = credentials.get("nacos_agent_service_name_format")
+                if service_name_format:
+                    try:
+                        service_name_format.format(name="agent", version="1.0.0")
+                    except (KeyError, IndexError, ValueError) as e:
+                        raise ValueError(f"invalid agent endpoint service name format: {e}")
 
                 if nacos_addr:
                     ai_client_config =ClientConfigBuilder().server_address(
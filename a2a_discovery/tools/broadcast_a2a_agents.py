@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from collections.abc import Generator
+from typing import Any
+from uuid import uuid4
+
+from dify_plugin import Tool
+from dify_plugin.config.logger_format import plugin_logger_handler
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+from tools.endpoints import AgentEndpointNaming, get_agent_instances
+from tools.utils import (
+	collect_a2a_response,
+	get_agent_directory,
+	get_target_agent,
+	parse_available_agents_nacos,
+	run_async,
+	send_a2a_message,
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.addHandler(plugin_logger_handler)
+
+BROADCAST_MODES = ("all", "first", "quorum")
+
+
+class BroadcastA2aAgentsTool(Tool):
+	def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[
+		ToolInvokeMessage]:
+
+		# Get discovery configuration
+		agent_directory = get_agent_directory(
+				tool_parameters.get("discovery_type"),
+				tool_parameters.get("available_agent_names"),
+				tool_parameters.get("available_agent_urls"),
+		)
+		namespace_id = tool_parameters.get("namespace_id")
+
+		# Get target agents selected by LLM, all available agents when empty,
+		# each agent is called once even if it is listed several times
+		target_agents = list(dict.fromkeys(
+				parse_available_agents_nacos(tool_parameters.get("target_agents"))
+				or agent_directory.names))
+		query = tool_parameters.get("query")
+		mode = tool_parameters.get("mode") or "all"
+		quorum = int(tool_parameters.get("quorum") or 1)
+		timeout_seconds = tool_parameters.get("timeout_seconds")
+		timeout_seconds = float(timeout_seconds) if timeout_seconds else None
+
+		# Get Nacos credentials
+		nacos_addr = self.runtime.credentials.get("nacos_addr")
+		username = self.runtime.credentials.get("nacos_username")
+		password = self.runtime.credentials.get("nacos_password")
+		access_key = self.runtime.credentials.get("nacos_accessKey")
+		secret_key = self.runtime.credentials.get("nacos_secretKey")
+
+		if mode not in BROADCAST_MODES:
+			raise ValueError(f"Invalid mode: {mode}, must be one of {BROADCAST_MODES}")
+		if not target_agents:
+			raise ValueError("No target agents to broadcast to")
+		# all needs every agent, first needs one success
+		required = {"all": len(target_agents), "first": 1}.get(mode, quorum)
+		if not 1 <= required <= len(target_agents):
+			raise ValueError(f"quorum must be between 1 and the number of target agents ({len(target_agents)})")
+		logger.info(f"Broadcasting to agents: {target_agents}, mode: {mode}")
+
+		context_id = str(uuid4()) if self.session.conversation_id is None \
+			else self.session.conversation_id
+
+		async def call_agent(target_agent: str) -> dict:
+			start = time.perf_counter()
+			try:
+				agent = await get_target_agent(
+						agent_directory=agent_directory,
+						target_agent=target_agent,
+						nacos_addr=nacos_addr,
+						namespace_id=namespace_id,
+						username=username,
+						password=password,
+						access_key=access_key,
+						secret_key=secret_key
+				)
+				instances = None
+				if agent_directory.discovery_type == "nacos":
+					instances = await get_agent_instances(
+							agent.agent_card, agent.registration_type, nacos_addr, namespace_id, username, password, access_key, secret_key,
+							AgentEndpointNaming.from_credentials(self.runtime.credentials))
+				result = await collect_a2a_response(
+						send_a2a_message(agent.agent_card, query, context_id, instances=instances))
+				return {
+					"agent_name": target_agent,
+					"success": True,
+					"latency_ms": round((time.perf_counter() - start) * 1000, 1),
+					"result": result,
+				}
+			except Exception as e:
+				logger.warning(f"Broadcast to agent '{target_agent}' failed: {e}")
+				return {
+					"agent_name": target_agent,
+					"success": False,
+					"latency_ms": round((time.perf_counter() - start) * 1000, 1),
+					"error": str(e),
+				}
+
+		async def broadcast() -> list[dict]:
+			start = time.perf_counter()
+			pending = {asyncio.ensure_future(call_agent(name)): name for name in target_agents}
+			results: dict[str, dict] = {}
+			succeeded = 0
+			deadline = None if timeout_seconds is None else time.monotonic() + timeout_seconds
+			def settled() -> bool:
+				# all waits for every agent, the other modes stop once enough agents
+				# answered or too many failed to still reach the goal
+				if mode == "all":
+					return False
+				return succeeded >= required or len(results) - succeeded > len(target_agents) - required
+
+			try:
+				while pending and not settled():
+					remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+					done, _ = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+					if not done:
+						break
+					for task in done:
+						result = task.result()
+						results[pending.pop(task)] = result
+						succeeded += result["success"]
+			finally:
+				# Cancel the agents still running, their answers are no longer needed
+				for task, name in pending.items():
+					task.cancel()
+					results[name] = {
+						"agent_name": name,
+						"success": False,
+						"cancelled": True,
+						"latency_ms": round((time.perf_counter() - start) * 1000, 1),
+					}
+				if pending:
+					await asyncio.gather(*pending, return_exceptions=True)
+			return [results[name] for name in target_agents]
+
+		try:
+			start = time.perf_counter()
+			results = run_async(broadcast())
+			elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+		except Exception as e:
+			logger.error(f"Error broadcasting to agents {target_agents}: {e}")
+			raise
+
+		successes = [result for result in results if result["success"]]
+		response = {
+			"mode": mode,
+			"succeeded": len(successes),
+			"required": required,
+			"satisfied": len(successes) >= required,
+			"elapsed_ms": elapsed_ms,
+			"results": results,
+		}
+		if mode == "first" and successes:
+			response["winner"] = min(successes, key=lambda result: result["latency_ms"])["agent_name"]
+		yield self.create_json_message(response)
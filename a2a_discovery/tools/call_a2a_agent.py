@@ -1,17 +1,31 @@
-import asyncio
 import logging
-from collections.abc import Generator
+from collections.abc import AsyncIterator, Generator
 from typing import Any
 from uuid import uuid4
 
-import httpx
-from a2a.client import ClientFactory, ClientConfig
-from a2a.types import AgentCard, Message, TextPart, Part, Role
+from a2a.types import (
+	Message,
+	MessageSendConfiguration,
+	PushNotificationConfig,
+	Task,
+	TaskArtifactUpdateEvent,
+	TaskStatusUpdateEvent,
+)
 from dify_plugin import Tool
 from dify_plugin.config.logger_format import plugin_logger_handler
 from dify_plugin.entities.tool import ToolInvokeMessage
 
-from tools.utils import get_target_agent_card, get_agent_names_list
+from tools.conversations import conversation_store
+from tools.endpoints import AgentEndpointNaming, get_agent_instances
+from tools.utils import (
+	collect_a2a_response,
+	get_agent_directory,
+	get_parts_text,
+	get_target_agent,
+	iter_async,
+	run_async,
+	send_a2a_message,
+)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -23,9 +37,11 @@ class CallA2aAgentTool(Tool):
 		ToolInvokeMessage]:
 
 		# Get discovery configuration
-		discovery_type = tool_parameters.get("discovery_type")
-		available_agent_names = tool_parameters.get("available_agent_names")
-		available_agent_urls = tool_parameters.get("available_agent_urls")
+		agent_directory = get_agent_directory(
+				tool_parameters.get("discovery_type"),
+				tool_parameters.get("available_agent_names"),
+				tool_parameters.get("available_agent_urls"),
+		)
 		namespace_id = tool_parameters.get("namespace_id")
 		
 		# Get target agent selected by LLM
@@ -40,15 +56,32 @@ class CallA2aAgentTool(Tool):
 		secret_key = self.runtime.credentials.get("nacos_secretKey")
 		
 		# Log available agents for debugging
-		available_names = get_agent_names_list(discovery_type, available_agent_names, available_agent_urls)
-		logger.info(f"Available agents: {available_names}, Target agent: {target_agent}")
+		logger.info(f"Available agents: {list(agent_directory.names)}, Target agent: {target_agent}")
 
-		async def call_a2a_agent():
-			agent_card: AgentCard = await get_target_agent_card(
-					discovery_type=discovery_type,
+		response_mode = tool_parameters.get("response_mode") or "blocking"
+		push_notification_url = tool_parameters.get("push_notification_url")
+
+		# In async mode the agent only acknowledges the task, its result is
+		# fetched later with get_a2a_task or pushed to push_notification_url
+		configuration = None
+		push_notification_token = None
+		if response_mode == "async":
+			push_notification_config = None
+			if push_notification_url:
+				push_notification_token = uuid4().hex
+				push_notification_config = PushNotificationConfig(
+						url=push_notification_url,
+						token=push_notification_token,
+				)
+			configuration = MessageSendConfiguration(
+					blocking=False,
+					push_notification_config=push_notification_config,
+			)
+
+		async def call_a2a_agent(streaming: bool) -> AsyncIterator[Any]:
+			agent = await get_target_agent(
+					agent_directory=agent_directory,
 					target_agent=target_agent,
-					available_agent_names=available_agent_names,
-					available_agent_urls=available_agent_urls,
 					nacos_addr=nacos_addr,
 					namespace_id=namespace_id,
 					username=username,
@@ -56,65 +89,77 @@ class CallA2aAgentTool(Tool):
 					access_key=access_key,
 					secret_key=secret_key
 			)
+			# Within a Dify conversation the agent's context, open task and clients are kept
+			conversation = None
+			if self.session.conversation_id is None:
+				context_id = str(uuid4())
+			else:
+				context_id = self.session.conversation_id
+				conversation = conversation_store.get_or_create(
+						(context_id, agent_directory.discovery_type, target_agent), context_id)
+			instances = None
+			if agent_directory.discovery_type == "nacos":
+				instances = await get_agent_instances(
+						agent.agent_card, agent.registration_type, nacos_addr, namespace_id, username, password, access_key, secret_key,
+						AgentEndpointNaming.from_credentials(self.runtime.credentials))
+			async for item in send_a2a_message(
+					agent.agent_card, query, context_id, streaming, instances, conversation, configuration):
+				yield item
 
-			a2a_client_config = ClientConfig(
-					streaming=False,
-					polling=False,
-					httpx_client=httpx.AsyncClient(
-							timeout=httpx.Timeout(timeout=600),
-					),
-			)
+		if response_mode == "streaming":
+			yield from self._stream(target_agent, call_a2a_agent(streaming=True))
+			return
 
-			a2a_client_factory = ClientFactory(
-					config=a2a_client_config,
-			)
+		try:
+			call_result = run_async(collect_a2a_response(call_a2a_agent(streaming=False)))
+		except Exception as e:
+			logger.error(f"Error calling agent '{target_agent}': {e}")
+			raise
 
-			msg = Message(
-					role=Role.user,
-					parts=[
-						Part(root=TextPart(
-								text=query,
-						))
-					],
-					message_id=str(uuid4()),
-					context_id=str(uuid4()) if self.session.conversation_id is None
-					else self.session.conversation_id
-			)
-			client = a2a_client_factory.create(
-					card=agent_card,
-			)
-			response_msg = None
-			async for item in client.send_message(msg):
+		if response_mode == "async" and isinstance(call_result, Task):
+			yield self.create_json_message({
+				"target_agent": target_agent,
+				"task_id": call_result.id,
+				"context_id": call_result.context_id,
+				"state": call_result.status.state,
+				"push_notification_token": push_notification_token,
+			})
+			return
+
+		yield self.create_json_message({
+			"target_agent": target_agent,
+			"result": call_result
+		})
+
+	def _stream(self, target_agent: str, events: AsyncIterator[Any]) -> Generator[ToolInvokeMessage]:
+		"""
+		Forward status updates and artifact chunks as text messages while the
+		agent is working, then the final task or message as JSON.
+		"""
+		result = None
+		try:
+			for item in iter_async(events):
 				if isinstance(item, Message):
-					response_msg = item
-					logger.debug(
-							"[%s] Received direct message response",
-							self.__class__.__name__,
-					)
+					result = item
+					text = get_parts_text(item.parts)
 				elif isinstance(item, tuple):
 					task, update_event = item
-					if task is not None:
-						response_msg = task
-					elif update_event is not None:
-						response_msg = update_event
+					result = task if task is not None else update_event
+					if isinstance(update_event, TaskArtifactUpdateEvent):
+						text = get_parts_text(update_event.artifact.parts)
+					elif isinstance(update_event, TaskStatusUpdateEvent) and update_event.status.message:
+						text = get_parts_text(update_event.status.message.parts)
 					else:
-						raise ValueError("Invalid item")
-
-			return response_msg
-
-		try:
-			loop = asyncio.get_event_loop()
-		except RuntimeError:
-			loop = asyncio.new_event_loop()
-			asyncio.set_event_loop(loop)
-
-		try:
-			call_result = loop.run_until_complete(call_a2a_agent())
+						text = None
+				else:
+					raise ValueError("Invalid item")
+				if text:
+					yield self.create_text_message(text)
 		except Exception as e:
-			logger.error(f"Error calling agent '{target_agent}': {e}")
+			logger.error(f"Error streaming from agent '{target_agent}': {e}")
 			raise
 
 		yield self.create_json_message({
 			"target_agent": target_agent,
-			"result": call_result
+			"result": result
 		})
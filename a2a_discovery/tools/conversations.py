@@ -0,0 +1,113 @@
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from a2a.client import Client
+from a2a.types import Message, TaskState, TaskStatusUpdateEvent
+
+# Idle time after which the A2A state of a conversation is forgotten
+CONVERSATION_TTL_SECONDS = 30 * 60
+CONVERSATION_MAX_ENTRIES = 1024
+# Task states in which the next message of the conversation continues the task
+CONTINUABLE_TASK_STATES = (TaskState.input_required, TaskState.auth_required)
+# Tasks per conversation whose serving instance is remembered
+TASK_ENDPOINTS_MAX_ENTRIES = 64
+
+
+class A2AConversation:
+	"""
+	A2A state of one Dify conversation with one agent.
+
+	Keeps the context and task ids returned by the agent, so that follow-up
+	messages continue the same context (and an input-required task), the
+	clients already built for the agent's endpoints and the instance that
+	served each task.
+	"""
+
+	def __init__(self, context_id: str):
+		self.context_id = context_id
+		self.task_id: Optional[str] = None
+		self.task_state: Optional[TaskState] = None
+		self.clients: dict[tuple, Client] = {}
+		# (ip, port) of the agent instance that served the last exchange
+		self.endpoint: Optional[tuple] = None
+		# (ip, port) of the agent instance holding each task, by task id
+		self.task_endpoints: OrderedDict[str, tuple] = OrderedDict()
+
+	def prepare(self, msg: Message) -> Message:
+		"""
+		Attach the conversation's context and task to an outgoing message.
+		"""
+		msg.context_id = self.context_id
+		if self.task_id is not None:
+			if self.task_state in CONTINUABLE_TASK_STATES:
+				msg.task_id = self.task_id
+			else:
+				msg.reference_task_ids = [self.task_id]
+		return msg
+
+	def update(self, item: Any) -> None:
+		"""
+		Track the ids and state from an item yielded by Client.send_message.
+		"""
+		if isinstance(item, Message):
+			self.context_id = item.context_id or self.context_id
+			if item.task_id:
+				self.task_id = item.task_id
+			return
+		task, update_event = item
+		if task is not None:
+			self.context_id = task.context_id or self.context_id
+			self.task_id = task.id
+			self.task_state = task.status.state
+		elif isinstance(update_event, TaskStatusUpdateEvent):
+			self.task_id = update_event.task_id
+			self.task_state = update_event.status.state
+
+	def record_endpoint(self, endpoint: tuple) -> None:
+		"""
+		Remember the instance that served the last exchange and holds its task.
+		"""
+		self.endpoint = endpoint
+		if self.task_id is not None:
+			self.task_endpoints.pop(self.task_id, None)
+			self.task_endpoints[self.task_id] = endpoint
+			while len(self.task_endpoints) > TASK_ENDPOINTS_MAX_ENTRIES:
+				self.task_endpoints.popitem(last=False)
+
+	def task_endpoint(self, task_id: str) -> Optional[tuple]:
+		"""
+		Instance holding a task submitted in this conversation, if known.
+		"""
+		return self.task_endpoints.get(task_id)
+
+
+class A2AConversationStore:
+	"""
+	Process-level LRU of A2AConversation, entries expire after
+	CONVERSATION_TTL_SECONDS without use.
+
+	Must only be used on the shared event loop of tools.utils.run_async.
+	"""
+
+	def __init__(self, max_entries: int = CONVERSATION_MAX_ENTRIES):
+		self.max_entries = max_entries
+		self._entries: OrderedDict[tuple, tuple[float, A2AConversation]] = OrderedDict()
+
+	def get_or_create(self, key: tuple, context_id: str) -> A2AConversation:
+		now = time.monotonic()
+		entry = self._entries.pop(key, None)
+		conversation = entry[1] if entry is not None and entry[0] > now else A2AConversation(context_id)
+		self._entries[key] = (now + CONVERSATION_TTL_SECONDS, conversation)
+		while len(self._entries) > self.max_entries:
+			self._entries.popitem(last=False)
+		# Expired entries sit at the front once they stop being used
+		while self._entries:
+			oldest_key, (expires_at, _) = next(iter(self._entries.items()))
+			if expires_at > now:
+				break
+			del self._entries[oldest_key]
+		return conversation
+
+
+conversation_store = A2AConversationStore()
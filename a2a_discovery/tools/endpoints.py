@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import random
+import time
+from collections.abc import Mapping
+from typing import Any, NamedTuple, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from a2a.types import AgentCard
+from dify_plugin.config.logger_format import plugin_logger_handler
+from v2.nacos import Instance, ListInstanceParam, NacosNamingService
+from v2.nacos.ai.model.ai_constant import AIConstants
+
+from tools.nacos_directory import build_nacos_client_config
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.addHandler(plugin_logger_handler)
+
+# Default naming group and service name format of the instances behind a SERVICE
+# registered agent. Nacos does not expose these through its client API, the
+# defaults follow the server's {agent name}::{version} convention and can be
+# overridden with the nacos_agent_endpoint_group and
+# nacos_agent_service_name_format provider credentials.
+DEFAULT_AGENT_ENDPOINT_GROUP = "agent-endpoints"
+DEFAULT_AGENT_SERVICE_NAME_FORMAT = "{name}::{version}"
+# Smoothing factor of the per-instance latency average
+ENDPOINT_LATENCY_DECAY = 0.3
+# Consecutive failures after which an instance is skipped for ENDPOINT_EJECT_SECONDS
+ENDPOINT_EJECT_FAILURES = 3
+ENDPOINT_EJECT_SECONDS = 30
+# Instances tried for one call before giving up
+ENDPOINT_MAX_ATTEMPTS = 3
+# Statuses after which a call may be retried on another instance
+ENDPOINT_RETRY_STATUS_CODES = (502, 503, 504)
+# Stats of instances without calls for this long are dropped, checked at most
+# once per ENDPOINT_STATS_PRUNE_SECONDS
+ENDPOINT_STATS_TTL_SECONDS = 10 * 60
+ENDPOINT_STATS_PRUNE_SECONDS = 60
+
+
+class AgentEndpointNaming(NamedTuple):
+	"""Where the instances of SERVICE registered agents are found in Nacos naming."""
+	group: str = DEFAULT_AGENT_ENDPOINT_GROUP
+	service_name_format: str = DEFAULT_AGENT_SERVICE_NAME_FORMAT
+
+	@classmethod
+	def from_credentials(cls, credentials: Mapping[str, Any]) -> "AgentEndpointNaming":
+		return cls(
+			credentials.get("nacos_agent_endpoint_group") or DEFAULT_AGENT_ENDPOINT_GROUP,
+			credentials.get("nacos_agent_service_name_format") or DEFAULT_AGENT_SERVICE_NAME_FORMAT,
+		)
+
+	def service_name(self, agent_name: str, version: Optional[str]) -> str:
+		return self.service_name_format.format(name=agent_name, version=version)
+
+
+def endpoint_agent_card(agent_card: AgentCard, endpoint: tuple[str, int]) -> AgentCard:
+	"""
+	Copy an agent card with its URL pointed at an (ip, port), scheme and path are kept.
+	"""
+	url = urlsplit(agent_card.url)
+	ip, port = endpoint
+	# IPv6 addresses must be bracketed in URLs
+	host = f"[{ip}]" if ":" in ip else ip
+	return agent_card.model_copy(update={
+		"url": urlunsplit((url.scheme, f"{host}:{port}", url.path, url.query, url.fragment))
+	})
+
+
+def instance_agent_card(agent_card: AgentCard, instance: Instance) -> AgentCard:
+	return endpoint_agent_card(agent_card, (instance.ip, instance.port))
+
+
+class EndpointSelector:
+	"""
+	Chooses agent instances by load and latency and ejects failing ones.
+
+	Of two random candidates the one with the lower
+	(in-flight calls + 1) * average latency / weight is picked, which spreads
+	calls over replicas without herding onto a single fast instance.
+	"""
+
+	def __init__(self):
+		self._stats: dict[tuple, dict] = {}
+		self._pruned_at = time.monotonic()
+
+	def _get_stats(self, instance: Instance) -> dict:
+		key = (instance.ip, instance.port)
+		stats = self._stats.get(key)
+		if stats is None:
+			stats = {"in_flight": 0, "latency_ms": None, "failures": 0, "ejected_until": 0, "used_at": 0}
+			self._stats[key] = stats
+		return stats
+
+	def _prune(self, now: float) -> None:
+		"""Drop the stats of instances that have gone away, i.e. were not called for a while."""
+		if now - self._pruned_at < ENDPOINT_STATS_PRUNE_SECONDS:
+			return
+		self._pruned_at = now
+		for key in [key for key, stats in self._stats.items()
+					if stats["in_flight"] == 0 and now - stats["used_at"] > ENDPOINT_STATS_TTL_SECONDS]:
+			del self._stats[key]
+
+	def _score(self, instance: Instance) -> float:
+		stats = self._get_stats(instance)
+		# Unmeasured instances score 0 so that they get tried
+		latency_ms = stats["latency_ms"] or 0
+		return (stats["in_flight"] + 1) * latency_ms / max(instance.weight, 0.01)
+
+	def choose(self, instances: list[Instance], exclude: set = frozenset()) -> Optional[Instance]:
+		candidates = [instance for instance in instances if (instance.ip, instance.port) not in exclude]
+		if not candidates:
+			return None
+		now = time.monotonic()
+		self._prune(now)
+		available = [instance for instance in candidates if self._get_stats(instance)["ejected_until"] <= now]
+		# With every instance ejected, trying one beats failing outright
+		candidates = available or candidates
+		if len(candidates) == 1:
+			return candidates[0]
+		return min(random.sample(candidates, 2), key=self._score)
+
+	def begin(self, instance: Instance) -> float:
+		stats = self._get_stats(instance)
+		stats["in_flight"] += 1
+		stats["used_at"] = time.monotonic()
+		return stats["used_at"]
+
+	def abandon(self, instance: Instance) -> None:
+		"""End a call that was cancelled, its outcome and latency say nothing about the instance."""
+		self._get_stats(instance)["in_flight"] -= 1
+
+	def end(self, instance: Instance, started: float, success: bool) -> None:
+		stats = self._get_stats(instance)
+		stats["in_flight"] -= 1
+		if not success:
+			stats["failures"] += 1
+			if stats["failures"] >= ENDPOINT_EJECT_FAILURES:
+				stats["ejected_until"] = time.monotonic() + ENDPOINT_EJECT_SECONDS
+				logger.warning(f"Ejecting agent instance {instance.ip}:{instance.port} "
+							   f"after {stats['failures']} consecutive failures")
+			return
+		latency_ms = (time.monotonic() - started) * 1000
+		stats["failures"] = 0
+		stats["ejected_until"] = 0
+		stats["latency_ms"] = latency_ms if stats["latency_ms"] is None else \
+			ENDPOINT_LATENCY_DECAY * latency_ms + (1 - ENDPOINT_LATENCY_DECAY) * stats["latency_ms"]
+
+
+endpoint_selector = EndpointSelector()
+
+_naming_services: dict[tuple, NacosNamingService] = {}
+_naming_services_lock: Optional[asyncio.Lock] = None
+
+
+async def get_naming_service(
+		nacos_addr: str,
+		namespace_id: str,
+		username: str,
+		password: str,
+		access_key: str,
+		secret_key: str
+) -> NacosNamingService:
+	global _naming_services_lock
+	if _naming_services_lock is None:
+		_naming_services_lock = asyncio.Lock()
+
+	key = (nacos_addr, namespace_id, username, password, access_key, secret_key)
+	naming_service = _naming_services.get(key)
+	if naming_service is not None:
+		return naming_service
+
+	async with _naming_services_lock:
+		naming_service = _naming_services.get(key)
+		if naming_service is None:
+			naming_service = await NacosNamingService.create_naming_service(build_nacos_client_config(
+				nacos_addr, namespace_id, username, password, access_key, secret_key))
+			_naming_services[key] = naming_service
+		return naming_service
+
+
+async def get_agent_instances(
+		agent_card: AgentCard,
+		registration_type: Optional[str],
+		nacos_addr: str,
+		namespace_id: str,
+		username: str,
+		password: str,
+		access_key: str,
+		secret_key: str,
+		naming: AgentEndpointNaming = AgentEndpointNaming()
+) -> Optional[list[Instance]]:
+	"""
+	List the healthy instances of a SERVICE registered agent.
+
+	Instances are subscribed, later calls are served from the naming
+	client's pushed cache.
+
+	Args:
+		agent_card: The agent's card
+		registration_type: How the agent is registered in Nacos, as resolved
+			with the card (see DiscoveredAgent)
+
+	Returns:
+		The instances, or None when the agent is registered by URL or no
+		instance is available, in which case the card URL should be used
+	"""
+	if registration_type != AIConstants.A2A_ENDPOINT_TYPE_SERVICE:
+		return None
+	try:
+		naming_service = await get_naming_service(
+			nacos_addr, namespace_id, username, password, access_key, secret_key)
+		instances = await naming_service.list_instances(ListInstanceParam(
+			service_name=naming.service_name(agent_card.name, agent_card.version),
+			group_name=naming.group,
+			healthy_only=True,
+			subscribe=True))
+	except Exception as e:
+		logger.warning(f"Failed to list instances of agent '{agent_card.name}', using its card URL: {e}")
+		return None
+	return instances or None
@@ -1,4 +1,3 @@
-import asyncio
 import logging
 
 from collections.abc import Generator
@@ -9,7 +8,7 @@ from dify_plugin.config.logger_format import plugin_logger_handler
 from dify_plugin.entities.tool import ToolInvokeMessage
 
 
-from tools.utils import get_all_agents_info, get_agent_names_list
+from tools.utils import get_agent_directory, get_all_agents_info, run_async
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -21,9 +20,11 @@ class GetA2aAgentInformationTool(Tool):
 		ToolInvokeMessage]:
 
 		# Get discovery configuration
-		discovery_type = tool_parameters.get("discovery_type")
-		available_agent_names = tool_parameters.get("available_agent_names")
-		available_agent_urls = tool_parameters.get("available_agent_urls")
+		agent_directory = get_agent_directory(
+				tool_parameters.get("discovery_type"),
+				tool_parameters.get("available_agent_names"),
+				tool_parameters.get("available_agent_urls"),
+		)
 		namespace_id = tool_parameters.get("namespace_id")
 		
 		# Get Nacos credentials
@@ -34,20 +35,11 @@ class GetA2aAgentInformationTool(Tool):
 		secret_key = self.runtime.credentials.get("nacos_secretKey")
 		
 		# Log available agents for debugging
-		available_names = get_agent_names_list(discovery_type, available_agent_names, available_agent_urls)
-		logger.info(f"Getting information for all available agents: {available_names}")
+		logger.info(f"Getting information for all available agents: {list(agent_directory.names)}")
 
 		try:
-			loop = asyncio.get_event_loop()
-		except RuntimeError:
-			loop = asyncio.new_event_loop()
-			asyncio.set_event_loop(loop)
-
-		try:
-			agents_info = loop.run_until_complete(get_all_agents_info(
-					discovery_type=discovery_type,
-					available_agent_names=available_agent_names,
-					available_agent_urls=available_agent_urls,
+			agents_info = run_async(get_all_agents_info(
+					agent_directory=agent_directory,
 					nacos_addr=nacos_addr,
 					namespace_id=namespace_id,
 					username=username,
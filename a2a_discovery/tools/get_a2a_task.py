@@ -0,0 +1,79 @@
+import logging
+from collections.abc import Generator
+from typing import Any
+
+from dify_plugin import Tool
+from dify_plugin.config.logger_format import plugin_logger_handler
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+from tools.conversations import conversation_store
+from tools.utils import get_a2a_task, get_agent_directory, get_target_agent, run_async
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.addHandler(plugin_logger_handler)
+
+# Longest a single invocation waits for a task, keeps the tool call within plugin timeouts
+MAX_WAIT_SECONDS = 100
+
+
+class GetA2aTaskTool(Tool):
+	def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[
+		ToolInvokeMessage]:
+
+		# Get discovery configuration
+		agent_directory = get_agent_directory(
+				tool_parameters.get("discovery_type"),
+				tool_parameters.get("available_agent_names"),
+				tool_parameters.get("available_agent_urls"),
+		)
+		namespace_id = tool_parameters.get("namespace_id")
+
+		# Get the task submitted by call_a2a_agent in async mode
+		target_agent = tool_parameters.get("target_agent")
+		task_id = tool_parameters.get("task_id")
+		wait_seconds = min(max(float(tool_parameters.get("wait_seconds") or 0), 0), MAX_WAIT_SECONDS)
+		history_length = tool_parameters.get("history_length")
+		history_length = int(history_length) if history_length is not None else None
+
+		# Get Nacos credentials
+		nacos_addr = self.runtime.credentials.get("nacos_addr")
+		username = self.runtime.credentials.get("nacos_username")
+		password = self.runtime.credentials.get("nacos_password")
+		access_key = self.runtime.credentials.get("nacos_accessKey")
+		secret_key = self.runtime.credentials.get("nacos_secretKey")
+
+		if not task_id:
+			raise ValueError("task_id is required")
+		logger.info(f"Getting task {task_id} of agent {target_agent}, waiting up to {wait_seconds}s")
+
+		async def get_task():
+			agent = await get_target_agent(
+					agent_directory=agent_directory,
+					target_agent=target_agent,
+					nacos_addr=nacos_addr,
+					namespace_id=namespace_id,
+					username=username,
+					password=password,
+					access_key=access_key,
+					secret_key=secret_key
+			)
+			conversation = None
+			if self.session.conversation_id is not None:
+				conversation = conversation_store.get_or_create(
+						(self.session.conversation_id, agent_directory.discovery_type, target_agent),
+						self.session.conversation_id)
+			return await get_a2a_task(agent.agent_card, task_id, wait_seconds, history_length, conversation)
+
+		try:
+			task = run_async(get_task())
+		except Exception as e:
+			logger.error(f"Error getting task {task_id} of agent '{target_agent}': {e}")
+			raise
+
+		yield self.create_json_message({
+			"target_agent": target_agent,
+			"task_id": task.id,
+			"state": task.status.state,
+			"result": task
+		})
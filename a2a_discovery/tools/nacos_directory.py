@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from typing import NamedTuple, Optional
+
+from a2a.types import AgentCard
+from dify_plugin.config.logger_format import plugin_logger_handler
+from maintainer.ai.nacos_ai_maintainer_service import NacosAIMaintainerService
+from v2.nacos import ClientConfig, ClientConfigBuilder
+from v2.nacos.ai.model.a2a.a2a import AgentCardDetailInfo
+from v2.nacos.ai.model.ai_param import SubscribeAgentCardParam
+from v2.nacos.ai.nacos_ai_service import NacosAIService
+from v2.nacos.common.nacos_exception import SERVER_NOT_IMPLEMENTED, NacosException
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.addHandler(plugin_logger_handler)
+
+# How often subscribed agents are checked against the registry for deregistrations.
+# Card changes are pushed by the Nacos client, which refreshes them every 10 seconds.
+DIRECTORY_RECONCILE_SECONDS = 10
+DIRECTORY_LIST_PAGE_SIZE = 100
+# Back-off before retrying a server that does not support agent subscriptions
+DIRECTORY_RETRY_SECONDS = 60
+# Back-off before reconnecting after the subscription client failed to start
+DIRECTORY_CONNECT_RETRY_SECONDS = 5
+
+
+def build_nacos_client_config(
+		nacos_addr: str,
+		namespace_id: str,
+		username: str,
+		password: str,
+		access_key: str,
+		secret_key: str
+) -> ClientConfig:
+	if nacos_addr is None:
+		raise ValueError("when type is nacos, nacos_addr is required")
+
+	if ':' not in nacos_addr.split('//')[-1]:
+		nacos_addr = f"{nacos_addr}:8848"
+
+	return ClientConfigBuilder().server_address(
+			nacos_addr).namespace_id(
+			namespace_id).username(
+			username).password(
+			password).access_key(
+			access_key).secret_key(
+			secret_key).build()
+
+
+class DiscoveredAgent(NamedTuple):
+	"""An agent card and how the agent is registered in Nacos (None for URL agents)."""
+	agent_card: AgentCard
+	registration_type: Optional[str] = None
+
+
+def to_discovered_agent(agent_card_detail: AgentCardDetailInfo) -> DiscoveredAgent:
+	"""Split a Nacos agent card into the plain AgentCard and its registration type."""
+	return DiscoveredAgent(
+		AgentCard.model_validate(agent_card_detail.model_dump(include=set(AgentCard.model_fields))),
+		agent_card_detail.registration_type)
+
+
+class NacosAgentDirectory:
+	"""
+	Live agent cards of one Nacos namespace.
+
+	Agents are subscribed on first lookup and served from memory afterwards,
+	the Nacos client pushes new card versions through the subscription
+	callback. Deregistered agents are detected by listing the registry every
+	DIRECTORY_RECONCILE_SECONDS and are dropped from the directory.
+
+	Must be used on the shared event loop of tools.utils.run_async.
+	"""
+
+	def __init__(
+			self,
+			key: tuple,
+			ai_service: NacosAIService,
+			maintainer_service: NacosAIMaintainerService,
+			namespace_id: str
+	):
+		self._key = key
+		self._ai_service = ai_service
+		self._maintainer_service = maintainer_service
+		self._namespace_id = namespace_id
+		self._cards: dict[str, DiscoveredAgent] = {}
+		self._callbacks: dict[str, Callable[[str, AgentCardDetailInfo], Awaitable[None]]] = {}
+		self._subscribing: dict[str, asyncio.Task] = {}
+		self._reconcile_task: Optional[asyncio.Task] = None
+
+	async def get_agent(self, agent_name: str) -> Optional[DiscoveredAgent]:
+		"""
+		Returns:
+			The agent card with its registration type, or None when the server
+			turns out not to support agent subscriptions, the directory is
+			discarded in that case
+		"""
+		agent = self._cards.get(agent_name)
+		if agent is not None:
+			return agent
+
+		# Concurrent lookups of the same agent share one subscription
+		task = self._subscribing.get(agent_name)
+		if task is None:
+			task = asyncio.ensure_future(self._subscribe(agent_name))
+			self._subscribing[agent_name] = task
+			task.add_done_callback(lambda _: self._subscribing.pop(agent_name, None))
+		try:
+			return await asyncio.shield(task)
+		except NacosException as e:
+			if e.error_code != SERVER_NOT_IMPLEMENTED:
+				raise
+			logger.warning(f"Agent subscriptions unsupported by the Nacos server, using on-demand lookups: {e.message}")
+			await _discard_directory(self, DIRECTORY_RETRY_SECONDS)
+			return None
+
+	async def close(self) -> None:
+		if self._reconcile_task is not None:
+			self._reconcile_task.cancel()
+		self._cards.clear()
+		self._callbacks.clear()
+		await self._ai_service.shutdown()
+
+	async def _subscribe(self, agent_name: str) -> DiscoveredAgent:
+		async def on_agent_card_changed(_name: str, agent_card_detail: AgentCardDetailInfo) -> None:
+			if agent_name in self._callbacks:
+				logger.info(f"Agent card of '{agent_name}' changed, version {agent_card_detail.version}")
+				self._cards[agent_name] = to_discovered_agent(agent_card_detail)
+
+		param = SubscribeAgentCardParam(agent_name=agent_name, subscribe_callback=on_agent_card_changed)
+		try:
+			agent_card = await self._ai_service.subscribe_agent_card(param)
+			if agent_card is None:
+				raise ValueError(f"Agent card not found for agent '{agent_name}'")
+		except Exception:
+			await self._ai_service.unsubscribe_agent_card(param)
+			raise
+
+		agent = to_discovered_agent(agent_card)
+		self._callbacks[agent_name] = on_agent_card_changed
+		self._cards[agent_name] = agent
+		if self._reconcile_task is None or self._reconcile_task.done():
+			self._reconcile_task = asyncio.ensure_future(self._reconcile())
+		return agent
+
+	async def _unsubscribe(self, agent_name: str) -> None:
+		self._cards.pop(agent_name, None)
+		callback = self._callbacks.pop(agent_name, None)
+		if callback is not None:
+			await self._ai_service.unsubscribe_agent_card(
+				SubscribeAgentCardParam(agent_name=agent_name, subscribe_callback=callback))
+
+	async def _list_registered_names(self) -> set[str]:
+		names = set()
+		page_no = 1
+		while True:
+			_, _, pages_available, agent_cards = await self._maintainer_service.list_agent_cards_by_name(
+				namespace_id=self._namespace_id,
+				agent_name=None,
+				page_no=page_no,
+				page_size=DIRECTORY_LIST_PAGE_SIZE)
+			names.update(agent_card.name for agent_card in agent_cards)
+			if not agent_cards or page_no >= (pages_available or 0):
+				return names
+			page_no += 1
+
+	async def _reconcile(self) -> None:
+		while self._cards:
+			await asyncio.sleep(DIRECTORY_RECONCILE_SECONDS)
+			try:
+				registered_names = await self._list_registered_names()
+			except Exception as e:
+				logger.warning(f"Failed to list agents of namespace '{self._namespace_id}': {e}")
+				continue
+			for agent_name in [name for name in self._cards if name not in registered_names]:
+				logger.info(f"Agent '{agent_name}' was deregistered, removing it from the directory")
+				try:
+					await self._unsubscribe(agent_name)
+				except Exception as e:
+					logger.warning(f"Failed to unsubscribe agent '{agent_name}': {e}")
+
+
+_directories: dict[tuple, NacosAgentDirectory] = {}
+_directories_lock: Optional[asyncio.Lock] = None
+_unavailable_until: dict[tuple, float] = {}
+
+
+async def _discard_directory(directory: NacosAgentDirectory, retry_seconds: float) -> None:
+	"""Stop using a directory and skip its server for retry_seconds."""
+	if _directories.get(directory._key) is directory:
+		del _directories[directory._key]
+	_unavailable_until[directory._key] = time.monotonic() + retry_seconds
+	try:
+		await directory.close()
+	except Exception as e:
+		logger.warning(f"Failed to close the agent subscription client: {e}")
+
+
+async def get_nacos_agent_directory(
+		nacos_addr: str,
+		namespace_id: str,
+		username: str,
+		password: str,
+		access_key: str,
+		secret_key: str
+) -> Optional[NacosAgentDirectory]:
+	"""
+	Get the shared directory for a Nacos server and namespace.
+
+	Returns:
+		The directory, or None when the server does not support agent
+		subscriptions (checked again after DIRECTORY_RETRY_SECONDS) or the
+		subscription client could not connect (retried after
+		DIRECTORY_CONNECT_RETRY_SECONDS)
+	"""
+	global _directories_lock
+	if _directories_lock is None:
+		_directories_lock = asyncio.Lock()
+
+	key = (nacos_addr, namespace_id, username, password, access_key, secret_key)
+	directory = _directories.get(key)
+	if directory is not None or time.monotonic() < _unavailable_until.get(key, 0):
+		return directory
+
+	async with _directories_lock:
+		directory = _directories.get(key)
+		if directory is None and time.monotonic() >= _unavailable_until.get(key, 0):
+			client_config = build_nacos_client_config(
+				nacos_addr, namespace_id, username, password, access_key, secret_key)
+			try:
+				ai_service = await NacosAIService.create_ai_service(client_config)
+			except Exception as e:
+				unsupported = isinstance(e, NacosException) and e.error_code == SERVER_NOT_IMPLEMENTED
+				retry_seconds = DIRECTORY_RETRY_SECONDS if unsupported else DIRECTORY_CONNECT_RETRY_SECONDS
+				logger.warning(f"Agent subscription client for {nacos_addr} failed to start, "
+							   f"using on-demand lookups for {retry_seconds}s: {e}")
+				_unavailable_until[key] = time.monotonic() + retry_seconds
+				return None
+			try:
+				maintainer_service = await NacosAIMaintainerService.create_ai_service(client_config)
+			except BaseException:
+				await ai_service.shutdown()
+				raise
+			directory = NacosAgentDirectory(key, ai_service, maintainer_service, namespace_id)
+			_directories[key] = directory
+		return directory
@@ -1,13 +1,64 @@
+import asyncio
+import atexit
+import importlib.util
 import json
-from typing import Optional
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Awaitable, Callable, Coroutine, Iterable, Iterator, Mapping
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Optional
+from uuid import uuid4
 
 import httpx
-from a2a.client import A2AClientHTTPError, A2AClientJSONError
-from a2a.types import AgentCard
+from a2a.client import A2AClientHTTPError, A2AClientJSONError, Client, ClientConfig, ClientFactory
+from a2a.types import (
+	AgentCard,
+	Message,
+	MessageSendConfiguration,
+	Part,
+	Role,
+	Task,
+	TaskQueryParams,
+	TaskState,
+	TextPart,
+)
+from dify_plugin.config.logger_format import plugin_logger_handler
 from httpx import Timeout
 from maintainer.ai.nacos_ai_maintainer_service import NacosAIMaintainerService
 from pydantic import ValidationError
-from v2.nacos import ClientConfigBuilder
+from v2.nacos import Instance
+
+from tools.conversations import A2AConversation
+from tools.endpoints import (
+	ENDPOINT_MAX_ATTEMPTS,
+	ENDPOINT_RETRY_STATUS_CODES,
+	endpoint_agent_card,
+	endpoint_selector,
+	instance_agent_card,
+)
+from tools.nacos_directory import (
+	DiscoveredAgent,
+	build_nacos_client_config,
+	get_nacos_agent_directory,
+	to_discovered_agent,
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.addHandler(plugin_logger_handler)
+
+# Upper bound of agent cards fetched at the same time by get_all_agents_info
+AGENT_INFO_CONCURRENCY = 8
+# Time allowed for fetching a single agent card
+AGENT_CARD_TIMEOUT_SECONDS = 10
+# Backoff between tasks/get polls of a submitted task
+TASK_POLL_INITIAL_SECONDS = 1
+TASK_POLL_MAX_SECONDS = 10
+PENDING_TASK_STATES = (TaskState.submitted, TaskState.working)
 
 
 def parse_available_agents_nacos(available_agent_names: Optional[str]) -> list[str]:
@@ -62,12 +113,7 @@ def get_agent_names_list(discovery_type: str, available_agent_names: Optional[st
     Returns:
         List of available agent names
     """
-    if discovery_type == "nacos":
-        return parse_available_agents_nacos(available_agent_names)
-    elif discovery_type == "url":
-        url_mapping = parse_available_agents_url(available_agent_urls)
-        return list(url_mapping.keys())
-    return []
+    return list(get_agent_directory(discovery_type, available_agent_names, available_agent_urls).names)
 
 
 def validate_target_agent(target_agent: str, discovery_type: str, 
@@ -79,14 +125,93 @@ def validate_target_agent(target_agent: str, discovery_type: str,
     Raises:
         ValueError: If target_agent is not in the available list
     """
-    available_names = get_agent_names_list(discovery_type, available_agent_names, available_agent_urls)
-    if not available_names:
-        raise ValueError("No available agents configured. Please configure available_agent_names (Nacos mode) or available_agent_urls (URL mode).")
-    if target_agent not in available_names:
-        raise ValueError(f"Target agent '{target_agent}' is not in the available agents list: {available_names}")
+    get_agent_directory(discovery_type, available_agent_names, available_agent_urls).validate(target_agent)
+
+
+# Distinct agent configurations kept parsed
+AGENT_DIRECTORY_CACHE_SIZE = 64
+
+
+class AgentDirectory:
+	"""
+	Parsed available agents of one configuration.
+
+	Instances are shared between invocations through get_agent_directory and
+	must not be modified.
+	"""
+
+	def __init__(self, discovery_type: str, names: Iterable[str], urls: Mapping[str, str]):
+		self.discovery_type = discovery_type
+		self.names = tuple(names)
+		self.urls = MappingProxyType(dict(urls))
+		self._name_set = frozenset(self.names)
+
+	def validate(self, target_agent: str) -> None:
+		"""
+		Validate that target_agent exists in the available agents list.
+
+		Raises:
+			ValueError: If target_agent is not in the available list
+		"""
+		if not self.names:
+			raise ValueError("No available agents configured. Please configure available_agent_names (Nacos mode) or available_agent_urls (URL mode).")
+		if target_agent not in self._name_set:
+			raise ValueError(f"Target agent '{target_agent}' is not in the available agents list: {list(self.names)}")
+
+	def get_url(self, agent_name: str) -> str:
+		agent_url = self.urls.get(agent_name)
+		if not agent_url:
+			raise ValueError(f"URL not found for agent '{agent_name}'")
+		return agent_url
 
 
-async def get_a2a_agent_card(
+@lru_cache(maxsize=AGENT_DIRECTORY_CACHE_SIZE)
+def get_agent_directory(
+		discovery_type: str,
+		available_agent_names: Optional[str],
+		available_agent_urls: Optional[str]
+) -> AgentDirectory:
+	"""
+	Parse the agent configuration once per distinct set of tool parameters.
+
+	Args:
+		discovery_type: Either 'nacos' or 'url'
+		available_agent_names: For nacos mode, comma-separated names
+		available_agent_urls: For url mode, JSON mapping
+
+	Raises:
+		ValueError: If available_agent_urls is not a JSON object
+	"""
+	if discovery_type == "nacos":
+		return AgentDirectory(discovery_type, parse_available_agents_nacos(available_agent_names), {})
+	elif discovery_type == "url":
+		url_mapping = parse_available_agents_url(available_agent_urls)
+		return AgentDirectory(discovery_type, url_mapping.keys(), url_mapping)
+	return AgentDirectory(discovery_type, (), {})
+
+
+def get_parts_text(parts: Optional[list[Part]]) -> str:
+	"""
+	Join the text parts of a message or artifact, other part kinds are skipped.
+	"""
+	return "".join(part.root.text for part in parts or [] if isinstance(part.root, TextPart))
+
+
+async def create_nacos_ai_maintainer_service(
+		nacos_addr: str,
+		namespace_id: str,
+		username: str,
+		password: str,
+		access_key: str,
+		secret_key: str
+) -> NacosAIMaintainerService:
+	nacos_client_config = build_nacos_client_config(
+		nacos_addr, namespace_id, username, password, access_key, secret_key)
+	return await NacosAIMaintainerService.create_ai_service(
+		nacos_client_config)
+
+
+async def get_a2a_agent(
 		agent_type: str,
 		a2a_agent_url: str,
 		nacos_addr: str,
@@ -95,58 +220,72 @@ async def get_a2a_agent_card(
 		username: str,
 		password: str,
 		access_key: str,
-		secret_key: str
-) -> AgentCard:
-	agent_card: AgentCard | None = None
+		secret_key: str,
+		nacos_ai_maintainer_service: Optional[Callable[[], Awaitable[NacosAIMaintainerService]]] = None,
+		httpx_client: Optional[httpx.AsyncClient] = None
+) -> DiscoveredAgent:
+	"""
+	Get an AgentCard by URL or from the Nacos registry, with the agent's Nacos
+	registration type (None for URL agents).
+
+	Nacos cards come from the live NacosAgentDirectory of the namespace. On
+	servers without agent subscriptions, and for URL cards, they are served
+	from agent_card_cache when fresh. nacos_ai_maintainer_service optionally
+	provides a shared service, it is only awaited on a cache miss.
+	"""
 	if agent_type == "url":
 		if a2a_agent_url is None:
 			raise ValueError("when type is url, a2a_agent_url is required")
-		agent_card = await get_agent_card_from_url(a2a_agent_url)
+		return DiscoveredAgent(await get_agent_card_from_url(a2a_agent_url, httpx_client))
 	elif agent_type == "nacos":
 		if a2a_agent_name is None:
 			raise ValueError("when type is nacos, a2a_agent_name is required")
-		if nacos_addr is None:
-			raise ValueError("when type is nacos, nacos_addr is required")
-
-		if ':' not in nacos_addr.split('//')[-1]:
-			nacos_addr = f"{nacos_addr}:8848"
-
-		nacos_client_config = ClientConfigBuilder().server_address(
-				nacos_addr).namespace_id(
-				namespace_id).username(
-				username).password(
-				password).access_key(
-				access_key).secret_key(
-				secret_key).build()
-		nacos_ai_maintainer_service = await NacosAIMaintainerService.create_ai_service(
-			nacos_client_config)
-		agent_card = await nacos_ai_maintainer_service.get_agent_card(
-			namespace_id=namespace_id,
-			agent_name=a2a_agent_name,
-			registration_type="URL")
-	return agent_card
 
+		directory = await get_nacos_agent_directory(
+			nacos_addr, namespace_id, username, password, access_key, secret_key)
+		if directory is not None:
+			agent = await directory.get_agent(a2a_agent_name)
+			if agent is not None:
+				return agent
 
-async def get_target_agent_card(
-		discovery_type: str,
+		async def fetch_from_nacos(_entry: Optional[dict]) -> tuple[AgentCard, Optional[float], Optional[dict]]:
+			if nacos_ai_maintainer_service is None:
+				service = await create_nacos_ai_maintainer_service(
+					nacos_addr, namespace_id, username, password, access_key, secret_key)
+			else:
+				service = await nacos_ai_maintainer_service()
+			# An empty registration type makes the server use the agent's own setting
+			card = await service.get_agent_card(
+				namespace_id=namespace_id,
+				agent_name=a2a_agent_name,
+				registration_type="")
+			if card is None:
+				raise ValueError(f"Agent card not found for agent '{a2a_agent_name}'")
+			agent = to_discovered_agent(card)
+			return agent.agent_card, None, {"registration_type": agent.registration_type}
+
+		entry = await agent_card_cache.resolve_entry(
+			("nacos", nacos_addr, namespace_id, a2a_agent_name), fetch_from_nacos)
+		return DiscoveredAgent(entry["agent_card"], entry.get("registration_type"))
+	raise ValueError(f"Invalid agent type: {agent_type}")
+
+
+async def get_target_agent(
+		agent_directory: AgentDirectory,
 		target_agent: str,
-		available_agent_names: Optional[str],
-		available_agent_urls: Optional[str],
 		nacos_addr: str,
 		namespace_id: str,
 		username: str,
 		password: str,
 		access_key: str,
 		secret_key: str
-) -> AgentCard:
+) -> DiscoveredAgent:
 	"""
 	Get AgentCard for the target agent from multi-agent configuration.
 	
 	Args:
-		discovery_type: 'nacos' or 'url'
+		agent_directory: Parsed agent configuration from get_agent_directory
 		target_agent: The name of the agent to get
-		available_agent_names: For nacos mode, comma-separated agent names
-		available_agent_urls: For url mode, JSON mapping of name to URL
 		nacos_addr: Nacos server address
 		namespace_id: Nacos namespace ID
 		username: Nacos username
@@ -155,17 +294,17 @@ async def get_target_agent_card(
 		secret_key: Aliyun secret key
 	
 	Returns:
-		AgentCard for the target agent
+		AgentCard for the target agent with its Nacos registration type
 	
 	Raises:
 		ValueError: If target agent not found or configuration invalid
 	"""
 	# Validate target agent exists in available list
-	validate_target_agent(target_agent, discovery_type, available_agent_names, available_agent_urls)
+	agent_directory.validate(target_agent)
 	
-	if discovery_type == "nacos":
+	if agent_directory.discovery_type == "nacos":
 		# For Nacos mode, target_agent is the agent name in registry
-		return await get_a2a_agent_card(
+		return await get_a2a_agent(
 			agent_type="nacos",
 			a2a_agent_url=None,
 			nacos_addr=nacos_addr,
@@ -176,15 +315,11 @@ async def get_target_agent_card(
 			access_key=access_key,
 			secret_key=secret_key
 		)
-	elif discovery_type == "url":
+	elif agent_directory.discovery_type == "url":
 		# For URL mode, get URL from mapping
-		url_mapping = parse_available_agents_url(available_agent_urls)
-		agent_url = url_mapping.get(target_agent)
-		if not agent_url:
-			raise ValueError(f"URL not found for agent '{target_agent}'")
-		return await get_a2a_agent_card(
+		return await get_a2a_agent(
 			agent_type="url",
-			a2a_agent_url=agent_url,
+			a2a_agent_url=agent_directory.get_url(target_agent),
 			nacos_addr=None,
 			a2a_agent_name=None,
 			namespace_id=None,
@@ -194,13 +329,171 @@ async def get_target_agent_card(
 			secret_key=None
 		)
 	else:
-		raise ValueError(f"Invalid discovery_type: {discovery_type}")
+		raise ValueError(f"Invalid discovery_type: {agent_directory.discovery_type}")
+
+
+async def send_a2a_message(
+		agent_card: AgentCard,
+		query: str,
+		context_id: str,
+		streaming: bool = False,
+		instances: Optional[list[Instance]] = None,
+		conversation: Optional[A2AConversation] = None,
+		configuration: Optional[MessageSendConfiguration] = None
+) -> AsyncIterator[Any]:
+	"""
+	Send a text query to an agent and yield the Message or (Task, update event)
+	items of the exchange.
+
+	With streaming the client consumes SSE when the agent supports it, and
+	falls back to a single response otherwise. When instances of the agent are
+	given, one is chosen by endpoint_selector and the call moves to another
+	instance if it fails with a retryable status before any item was received.
+	A conversation supplies the context and task to continue, and the clients
+	to reuse, and is updated from the exchange. configuration overrides the
+	send options of this call, e.g. blocking=False to only submit the task.
+	"""
+	msg = Message(
+			role=Role.user,
+			parts=[
+				Part(root=TextPart(
+						text=query,
+				))
+			],
+			message_id=str(uuid4()),
+			context_id=context_id
+	)
+	if conversation is not None:
+		conversation.prepare(msg)
+	if not instances:
+		async for item in _send_message(agent_card, msg, streaming, conversation, configuration):
+			yield item
+		return
+
+	tried = set()
+	max_attempts = min(ENDPOINT_MAX_ATTEMPTS, len(instances))
+	for attempt in range(1, max_attempts + 1):
+		instance = None
+		if attempt == 1 and conversation is not None and conversation.endpoint is not None:
+			# Stay on the instance that holds the conversation's task
+			instance = next((i for i in instances if (i.ip, i.port) == conversation.endpoint), None)
+		instance = instance or endpoint_selector.choose(instances, tried)
+		tried.add((instance.ip, instance.port))
+		started = endpoint_selector.begin(instance)
+		received = False
+		failed = False
+		cancelled = False
+		try:
+			async for item in _send_message(
+					instance_agent_card(agent_card, instance), msg, streaming, conversation, configuration):
+				received = True
+				if conversation is not None:
+					# Recorded before yielding, the consumer may stop at the first event
+					conversation.record_endpoint((instance.ip, instance.port))
+				yield item
+			return
+		except (asyncio.CancelledError, GeneratorExit):
+			# A broadcast loser or a consumer that stopped early, not a result of the instance
+			cancelled = True
+			raise
+		except A2AClientHTTPError as e:
+			failed = True
+			if received or e.status_code not in ENDPOINT_RETRY_STATUS_CODES or attempt == max_attempts:
+				raise
+			logger.warning(f"Agent instance {instance.ip}:{instance.port} failed with {e.status_code}, "
+						   f"retrying on another instance")
+		except Exception:
+			failed = True
+			raise
+		finally:
+			if cancelled:
+				endpoint_selector.abandon(instance)
+			else:
+				endpoint_selector.end(instance, started, not failed)
+
+
+def _get_client(agent_card: AgentCard, streaming: bool, conversation: Optional[A2AConversation] = None) -> Client:
+	client_key = (agent_card.url, streaming)
+	client = conversation.clients.get(client_key) if conversation is not None else None
+	if client is None:
+		a2a_client_config = ClientConfig(
+				streaming=streaming,
+				polling=False,
+				httpx_client=get_httpx_client(A2A_CALL_TIMEOUT_SECONDS),
+		)
+		client = ClientFactory(config=a2a_client_config).create(card=agent_card)
+		if conversation is not None:
+			conversation.clients[client_key] = client
+	return client
+
+
+async def _send_message(
+		agent_card: AgentCard,
+		msg: Message,
+		streaming: bool,
+		conversation: Optional[A2AConversation] = None,
+		configuration: Optional[MessageSendConfiguration] = None
+) -> AsyncIterator[Any]:
+	client = _get_client(agent_card, streaming, conversation)
+	async for item in client.send_message(msg, configuration=configuration):
+		if conversation is not None:
+			conversation.update(item)
+		yield item
+
+
+async def get_a2a_task(
+		agent_card: AgentCard,
+		task_id: str,
+		wait_seconds: float = 0,
+		history_length: Optional[int] = None,
+		conversation: Optional[A2AConversation] = None
+) -> Task:
+	"""
+	Fetch a task with tasks/get, polling with exponential backoff while it is
+	submitted or working, for at most wait_seconds.
+
+	A conversation that submitted the task routes the request to the
+	instance holding it.
+	"""
+	endpoint = conversation.task_endpoint(task_id) if conversation is not None else None
+	if endpoint is not None:
+		agent_card = endpoint_agent_card(agent_card, endpoint)
+	client = _get_client(agent_card, False, conversation)
+	deadline = time.monotonic() + max(wait_seconds, 0)
+	interval = TASK_POLL_INITIAL_SECONDS
+	while True:
+		task = await client.get_task(TaskQueryParams(id=task_id, history_length=history_length))
+		if conversation is not None:
+			conversation.update((task, None))
+		remaining = deadline - time.monotonic()
+		if task.status.state not in PENDING_TASK_STATES or remaining <= 0:
+			return task
+		await asyncio.sleep(min(interval, remaining))
+		interval = min(interval * 2, TASK_POLL_MAX_SECONDS)
+
+
+async def collect_a2a_response(events: AsyncIterator[Any]) -> Any:
+	"""
+	Consume the items of send_a2a_message and return the last message, task or update event.
+	"""
+	response_msg = None
+	async for item in events:
+		if isinstance(item, Message):
+			response_msg = item
+			logger.debug("Received direct message response")
+		elif isinstance(item, tuple):
+			task, update_event = item
+			if task is not None:
+				response_msg = task
+			elif update_event is not None:
+				response_msg = update_event
+			else:
+				raise ValueError("Invalid item")
+	return response_msg
 
 
 async def get_all_agents_info(
-		discovery_type: str,
-		available_agent_names: Optional[str],
-		available_agent_urls: Optional[str],
+		agent_directory: AgentDirectory,
 		nacos_addr: str,
 		namespace_id: str,
 		username: str,
@@ -211,10 +504,11 @@ async def get_all_agents_info(
 	"""
 	Get information for all configured agents.
 	
+	Agent cards are fetched concurrently, at most AGENT_INFO_CONCURRENCY at a
+	time and each within AGENT_CARD_TIMEOUT_SECONDS.
+	
 	Args:
-		discovery_type: 'nacos' or 'url'
-		available_agent_names: For nacos mode, comma-separated agent names
-		available_agent_urls: For url mode, JSON mapping of name to URL
+		agent_directory: Parsed agent configuration from get_agent_directory
 		nacos_addr: Nacos server address
 		namespace_id: Nacos namespace ID
 		username: Nacos username
@@ -228,67 +522,451 @@ async def get_all_agents_info(
 		- description: Agent description from AgentCard
 		- skills: Agent skills from AgentCard
 	"""
-	agent_names = get_agent_names_list(discovery_type, available_agent_names, available_agent_urls)
+	agent_names = agent_directory.names
 	if not agent_names:
 		raise ValueError("No available agents configured. Please configure available_agent_names (Nacos mode) or available_agent_urls (URL mode).")
-	
-	results = []
-	for agent_name in agent_names:
+	discovery_type = agent_directory.discovery_type
+	url_mapping = agent_directory.urls
+	semaphore = asyncio.Semaphore(AGENT_INFO_CONCURRENCY)
+
+	async def get_agent_info(agent_name: str, nacos_ai_maintainer_service, httpx_client) -> dict:
 		try:
-			agent_card = await get_target_agent_card(
-				discovery_type=discovery_type,
-				target_agent=agent_name,
-				available_agent_names=available_agent_names,
-				available_agent_urls=available_agent_urls,
-				nacos_addr=nacos_addr,
-				namespace_id=namespace_id,
-				username=username,
-				password=password,
-				access_key=access_key,
-				secret_key=secret_key
-			)
-			results.append({
+			async with semaphore:
+				agent = await asyncio.wait_for(get_a2a_agent(
+					agent_type=discovery_type,
+					a2a_agent_url=url_mapping.get(agent_name),
+					nacos_addr=nacos_addr,
+					a2a_agent_name=agent_name,
+					namespace_id=namespace_id,
+					username=username,
+					password=password,
+					access_key=access_key,
+					secret_key=secret_key,
+					nacos_ai_maintainer_service=nacos_ai_maintainer_service,
+					httpx_client=httpx_client
+				), timeout=AGENT_CARD_TIMEOUT_SECONDS)
+			agent_card = agent.agent_card
+			return {
 				"agent_name": agent_name,  # Use configured name, not AgentCard.name
 				"description": agent_card.description,
 				"skills": agent_card.skills,
-			})
+			}
+		except asyncio.TimeoutError:
+			return {
+				"agent_name": agent_name,
+				"error": f"Timed out after {AGENT_CARD_TIMEOUT_SECONDS}s fetching agent card",
+			}
 		except Exception as e:
 			# Include error info for failed agents
-			results.append({
+			return {
 				"agent_name": agent_name,
 				"error": str(e),
-			})
-	
-	return results
+			}
+
+	# One registry connection and one HTTP client serve every lookup
+	if discovery_type == "nacos":
+		service_task: Optional[asyncio.Task] = None
+
+		def nacos_ai_maintainer_service() -> Awaitable[NacosAIMaintainerService]:
+			# Created on the first cache miss, shielded so a timed-out lookup does not cancel it
+			nonlocal service_task
+			if service_task is None:
+				service_task = asyncio.ensure_future(create_nacos_ai_maintainer_service(
+					nacos_addr, namespace_id, username, password, access_key, secret_key))
+			return asyncio.shield(service_task)
+
+		return list(await asyncio.gather(
+			*(get_agent_info(agent_name, nacos_ai_maintainer_service, None) for agent_name in agent_names)))
 
+	httpx_client = get_httpx_client(AGENT_CARD_TIMEOUT_SECONDS)
+	return list(await asyncio.gather(
+		*(get_agent_info(agent_name, None, httpx_client) for agent_name in agent_names)))
 
-async def get_agent_card_from_url(target_url:str) -> AgentCard:
 
-	_httpx_client = httpx.AsyncClient(timeout=Timeout(10))
+async def get_agent_card_from_url(target_url:str, httpx_client: Optional[httpx.AsyncClient] = None) -> AgentCard:
+	"""
+	Fetch an AgentCard from its URL through agent_card_cache.
+
+	Expired entries are revalidated with If-None-Match / If-Modified-Since, the
+	freshness lifetime follows the response Cache-Control header.
+	"""
+	async def fetch_from_url(entry: Optional[dict]) -> tuple[Optional[AgentCard], Optional[float], Optional[dict]]:
+		headers = {}
+		if entry is not None and entry.get("etag"):
+			headers["If-None-Match"] = entry["etag"]
+		if entry is not None and entry.get("last_modified"):
+			headers["If-Modified-Since"] = entry["last_modified"]
+		response = await _request_agent_card(target_url, httpx_client, headers)
+		ttl = parse_cache_control(response.headers.get("Cache-Control"))
+		validators = {
+			"etag": response.headers.get("ETag"),
+			"last_modified": response.headers.get("Last-Modified"),
+		}
+		if response.status_code == 304:
+			return None, ttl, validators
+		return _parse_agent_card(target_url, response), ttl, validators
+
+	return await agent_card_cache.resolve(("url", target_url), fetch_from_url)
+
+
+async def _request_agent_card(
+		target_url: str,
+		httpx_client: Optional[httpx.AsyncClient],
+		headers: dict[str, str]
+) -> httpx.Response:
+	_httpx_client = httpx_client or get_httpx_client()
 	try:
 		response = await _httpx_client.get(
 				target_url,
+				headers=headers,
 		)
-		response.raise_for_status()
-		agent_card_data = response.json()
-		agent_card = AgentCard.model_validate(agent_card_data)
+		if response.status_code != 304:
+			response.raise_for_status()
 	except httpx.HTTPStatusError as e:
 		raise A2AClientHTTPError(
 				e.response.status_code,
 				f'Failed to fetch agent card from {target_url}: {e}',
 		) from e
-	except json.JSONDecodeError as e:
-		raise A2AClientJSONError(
-				f'Failed to parse JSON for agent card from {target_url}: {e}'
-		) from e
 	except httpx.RequestError as e:
 		raise A2AClientHTTPError(
 				503,
 				f'Network communication error fetching agent card from {target_url}: {e}',
 		) from e
+	return response
+
+
+def _parse_agent_card(target_url: str, response: httpx.Response) -> AgentCard:
+	try:
+		agent_card_data = response.json()
+		agent_card = AgentCard.model_validate(agent_card_data)
+	except json.JSONDecodeError as e:
+		raise A2AClientJSONError(
+				f'Failed to parse JSON for agent card from {target_url}: {e}'
+		) from e
 	except ValidationError as e:  # Pydantic validation error
 		raise A2AClientJSONError(
 				f'Failed to validate agent card structure from {target_url}: {e.json()}'
 		) from e
 
-	return agent_card
\ No newline at end of file
+	return agent_card
+
+
+# ============== AgentCard cache ==============
+
+# Freshness lifetime when the source gives none
+AGENT_CARD_CACHE_TTL_SECONDS = 60
+# How long past expiry a card may still be served when refreshing it fails
+AGENT_CARD_STALE_SECONDS = 600
+AGENT_CARD_CACHE_MAX_ENTRIES = 256
+
+
+def parse_cache_control(value: Optional[str]) -> Optional[float]:
+	"""
+	Get the freshness lifetime from a Cache-Control header.
+
+	Returns:
+		max-age in seconds, 0 for no-cache/no-store, None when the header has neither
+	"""
+	if not value:
+		return None
+	max_age = None
+	for directive in value.lower().split(','):
+		name, _, arg = directive.strip().partition('=')
+		if name in ("no-cache", "no-store"):
+			return 0
+		if name in ("max-age", "s-maxage"):
+			try:
+				max_age = max(int(arg.strip().strip('"')), 0)
+			except ValueError:
+				pass
+	return max_age
+
+
+class AgentCardCache:
+	"""
+	Process-level LRU of agent cards shared by all tool invocations.
+
+	Entries are fresh for their TTL, then refetched (or revalidated for URL
+	cards). When a refetch fails the expired card keeps being served for up
+	to AGENT_CARD_STALE_SECONDS.
+	"""
+
+	def __init__(self, max_entries: int = AGENT_CARD_CACHE_MAX_ENTRIES):
+		self.max_entries = max_entries
+		self._entries: OrderedDict[tuple, dict] = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get_entry(self, key: tuple) -> Optional[dict]:
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None:
+				self._entries.move_to_end(key)
+			return entry
+
+	def put(self, key: tuple, agent_card: AgentCard, ttl: Optional[float] = None,
+			validators: Optional[dict] = None) -> dict:
+		entry = {
+			"agent_card": agent_card,
+			"expires_at": time.monotonic() + (AGENT_CARD_CACHE_TTL_SECONDS if ttl is None else ttl),
+			**(validators or {}),
+		}
+		with self._lock:
+			self._entries[key] = entry
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+		return entry
+
+	def invalidate(self, key: tuple) -> None:
+		with self._lock:
+			self._entries.pop(key, None)
+
+	async def resolve(
+			self,
+			key: tuple,
+			fetch: Callable[[Optional[dict]], Awaitable[tuple[Optional[AgentCard], Optional[float], Optional[dict]]]]
+	) -> AgentCard:
+		"""
+		Return the cached card for key, calling fetch when it is missing or expired.
+
+		fetch receives the current entry (for conditional requests) and returns
+		(agent card or None if not modified, ttl, validators).
+		"""
+		return (await self.resolve_entry(key, fetch))["agent_card"]
+
+	async def resolve_entry(
+			self,
+			key: tuple,
+			fetch: Callable[[Optional[dict]], Awaitable[tuple[Optional[AgentCard], Optional[float], Optional[dict]]]]
+	) -> dict:
+		"""
+		Like resolve, but return the whole cache entry, including the extra
+		fields fetch returned with the validators.
+		"""
+		entry = self.get_entry(key)
+		now = time.monotonic()
+		if entry is not None and now < entry["expires_at"]:
+			return entry
+
+		try:
+			agent_card, ttl, validators = await fetch(entry)
+		except Exception as e:
+			if entry is not None and now < entry["expires_at"] + AGENT_CARD_STALE_SECONDS:
+				logger.warning(f"Serving stale agent card for {key[-1]}, refresh failed: {e}")
+				return entry
+			raise
+
+		if agent_card is None:
+			if entry is None:
+				raise ValueError(f"Agent card source returned no content for {key[-1]}")
+			agent_card = entry["agent_card"]
+			validators = {k: v or entry.get(k) for k, v in (validators or {}).items()}
+		return self.put(key, agent_card, ttl, validators)
+
+
+agent_card_cache = AgentCardCache()
+
+
+# ============== Async runtime and HTTP pool ==============
+
+# Default timeout for agent calls, agents may take minutes to answer
+A2A_CALL_TIMEOUT_SECONDS = 600
+HTTP_CONNECT_TIMEOUT_SECONDS = 10
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_CONNECTIONS_PER_HOST = 20
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+HTTP_KEEPALIVE_EXPIRY_SECONDS = 30
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_transport: Optional[httpx.AsyncBaseTransport] = None
+_httpx_clients: dict[float, httpx.AsyncClient] = {}
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+	"""
+	Return the process-wide event loop, starting its thread on first use.
+
+	httpx clients and Nacos services are bound to the loop they were created
+	on, running every invocation on this loop lets them be shared.
+	"""
+	global _loop
+	with _loop_lock:
+		if _loop is None or _loop.is_closed():
+			loop = asyncio.new_event_loop()
+			threading.Thread(target=loop.run_forever, name="a2a-discovery-loop", daemon=True).start()
+			_loop = loop
+		return _loop
+
+
+def run_async(coro: Coroutine, timeout: Optional[float] = None) -> Any:
+	"""
+	Run a coroutine on the shared event loop and block until it finishes.
+	"""
+	future = asyncio.run_coroutine_threadsafe(coro, _get_loop())
+	try:
+		return future.result(timeout)
+	except TimeoutError:
+		future.cancel()
+		raise
+
+
+def iter_async(iterator: AsyncIterator, timeout: Optional[float] = None) -> Iterator:
+	"""
+	Consume an async iterator on the shared event loop as a plain iterator.
+
+	Each item is handed over as soon as it is produced, the async iterator is
+	closed when the consumer stops early.
+	"""
+	loop = _get_loop()
+
+	async def next_item():
+		return await iterator.__anext__()
+
+	try:
+		while True:
+			try:
+				yield run_async(next_item(), timeout)
+			except StopAsyncIteration:
+				return
+	finally:
+		aclose = getattr(iterator, "aclose", None)
+		if aclose is not None and not loop.is_closed():
+			try:
+				run_async(aclose(), timeout)
+			except Exception:
+				pass
+
+
+class _HostSlot:
+	"""One in-flight request slot of a host, released at most once."""
+
+	__slots__ = ("_semaphore", "_loop", "_released")
+
+	def __init__(self, semaphore: asyncio.Semaphore, loop: asyncio.AbstractEventLoop):
+		self._semaphore = semaphore
+		self._loop = loop
+		self._released = False
+
+	def release(self) -> None:
+		if not self._released:
+			self._released = True
+			self._semaphore.release()
+
+	def release_threadsafe(self) -> None:
+		"""Release from a garbage collector callback, which may run on any thread."""
+		try:
+			self._loop.call_soon_threadsafe(self.release)
+		except RuntimeError:
+			# The loop is closed, nothing can wait on the slot any more
+			pass
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+	"""
+	Response body that releases its host slot once closed.
+
+	A response that is dropped without being closed releases its slot when
+	it is garbage collected.
+	"""
+
+	def __init__(self, stream: httpx.AsyncByteStream, slot: _HostSlot):
+		self._stream = stream
+		self._slot = slot
+		weakref.finalize(self, slot.release_threadsafe)
+
+	async def __aiter__(self):
+		async for chunk in self._stream:
+			yield chunk
+
+	async def aclose(self) -> None:
+		try:
+			await self._stream.aclose()
+		finally:
+			self._slot.release()
+
+
+class HostLimitedTransport(httpx.AsyncBaseTransport):
+	"""
+	Wrap a transport so that each host has at most max_per_host requests in
+	flight, a response holds its slot until its body is closed or the
+	response is garbage collected.
+
+	Waiting for a slot is bounded by the pool timeout of the request, so a
+	leaked slot delays requests instead of blocking them forever.
+	"""
+
+	def __init__(self, transport: httpx.AsyncBaseTransport, max_per_host: int):
+		self._transport = transport
+		self._max_per_host = max_per_host
+		self._semaphores: dict[tuple, asyncio.Semaphore] = {}
+
+	async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+		host = (request.url.scheme, request.url.host, request.url.port)
+		semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self._max_per_host))
+		pool_timeout = request.extensions.get("timeout", {}).get("pool")
+		try:
+			await asyncio.wait_for(semaphore.acquire(), pool_timeout)
+		except asyncio.TimeoutError:
+			raise httpx.PoolTimeout(
+					f"no free connection slot for {request.url.host} within {pool_timeout}s", request=request)
+		slot = _HostSlot(semaphore, asyncio.get_running_loop())
+		try:
+			response = await self._transport.handle_async_request(request)
+		except BaseException:
+			slot.release()
+			raise
+		response.stream = _ReleasingStream(response.stream, slot)
+		return response
+
+	async def aclose(self) -> None:
+		await self._transport.aclose()
+
+
+def get_httpx_client(timeout: float = AGENT_CARD_TIMEOUT_SECONDS) -> httpx.AsyncClient:
+	"""
+	Get the shared httpx client for a read timeout, must be used on the loop of run_async.
+
+	Clients for different timeouts share one keep-alive connection pool, HTTP/2
+	is negotiated when the h2 package is installed.
+	"""
+	global _transport
+	client = _httpx_clients.get(timeout)
+	if client is None:
+		if _transport is None:
+			_transport = HostLimitedTransport(httpx.AsyncHTTPTransport(
+				http2=importlib.util.find_spec("h2") is not None,
+				limits=httpx.Limits(
+					max_connections=HTTP_MAX_CONNECTIONS,
+					max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+					keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+				),
+			), HTTP_MAX_CONNECTIONS_PER_HOST)
+		client = httpx.AsyncClient(
+			transport=_transport,
+			timeout=Timeout(timeout, connect=min(timeout, HTTP_CONNECT_TIMEOUT_SECONDS)),
+		)
+		_httpx_clients[timeout] = client
+	return client
+
+
+async def close_httpx_clients() -> None:
+	"""
+	Close the shared connection pool, clients are created again on next use.
+	"""
+	global _transport
+	transport, _transport = _transport, None
+	_httpx_clients.clear()
+	if transport is not None:
+		await transport.aclose()
+
+
+def _shutdown() -> None:
+	if _loop is not None and _loop.is_running() and _transport is not None:
+		try:
+			run_async(close_httpx_clients(), timeout=5)
+		except Exception:
+			pass
+
+
+atexit.register(_shutdown)
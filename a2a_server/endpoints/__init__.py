@@ -5,18 +5,26 @@ A2A Server Endpoints Package
 - adapters: Request/Response 适配器
 - conversation: 会话管理器
 - executor: Dify App 执行器
+- task_store: 基于 Dify Storage 的 TaskStore
+- registration: Nacos 注册协调器
 - a2a_server: 统一端点入口 (GET/POST)
 """
 
 from .a2a_server import A2aServerEndpoint
-from .adapters import StarletteRequestAdapter, ResponseAdapter
+from .adapters import StarletteRequestAdapter, ResponseAdapter, DifyCallContextBuilder, SessionScope
 from .conversation import ConversationManager
 from .executor import DifyAppAgentExecutor
+from .task_store import DifyStorageTaskStore
+from .registration import NacosRegistrar
 
 __all__ = [
     'A2aServerEndpoint',
     'StarletteRequestAdapter',
     'ResponseAdapter',
+    'DifyCallContextBuilder',
+    'SessionScope',
     'ConversationManager',
     'DifyAppAgentExecutor',
+    'DifyStorageTaskStore',
+    'NacosRegistrar',
 ]
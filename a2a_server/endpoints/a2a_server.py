@@ -7,8 +7,10 @@ A2A Server Endpoint
 """
 
 import json
-import asyncio
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 from collections.abc import Mapping
 
 from dify_plugin.config.logger_format import plugin_logger_handler
@@ -18,24 +20,60 @@ from dify_plugin import Endpoint
 # A2A SDK imports
 from a2a.server.apps import A2AStarletteApplication
 from a2a.server.request_handlers import DefaultRequestHandler
-from a2a.server.tasks import InMemoryTaskStore
 from a2a.types import AgentCard, AgentSkill, AgentCapabilities
 
 # 本地模块导入
-from .adapters import StarletteRequestAdapter, ResponseAdapter
-from .conversation import ConversationManager
-from .executor import DifyAppAgentExecutor
-from .utils import (
-    register_agent_card, 
-    get_agent_card,
-    get_cached_agent_card, 
-    set_cached_agent_card, 
-    needs_registration
+from .adapters import (
+    SESSION_STATE_KEY,
+    DifyCallContextBuilder,
+    SessionScope,
+    StarletteRequestAdapter,
+    ResponseAdapter,
+    parse_json_body,
 )
+from .executor import DifyAppAgentExecutor
+from .task_store import DifyStorageTaskStore
+from .registration import NacosTarget, nacos_registrar
+from .utils import canonical_agent_card_bytes, run_async
 
 logger = logging.getLogger(__name__)
 logger.addHandler(plugin_logger_handler)
 
+# 按配置指纹缓存的 A2A 应用及 Agent Card 数量上限，超出时淘汰最久未使用的
+MAX_CACHED_APPLICATIONS = 32
+
+# 客户端可缓存 Agent Card 的时间（秒），过期后用 If-None-Match 重新验证
+AGENT_CARD_MAX_AGE_SECONDS = 60
+
+_applications: OrderedDict[tuple, A2AStarletteApplication] = OrderedDict()
+_applications_lock = threading.Lock()
+_agent_card_responses: OrderedDict[tuple, 'AgentCardResponse'] = OrderedDict()
+_agent_card_responses_lock = threading.Lock()
+
+
+def settings_fingerprint(settings: Mapping) -> tuple:
+    """配置指纹：App ID 与构建 AgentCard 所用的字段"""
+    return (
+        (settings.get('app') or {}).get('app_id', ''),
+        settings.get('agent_name'),
+        settings.get('agent_description'),
+        settings.get('agent_url'),
+        settings.get('agent_version'),
+    )
+
+
+class AgentCardResponse:
+    """预先序列化的 Agent Card 及其强 ETag（即 AgentCard 的内容指纹）"""
+
+    __slots__ = ('agent_card', 'body', 'etag')
+
+    def __init__(self, agent_card: AgentCard):
+        self.agent_card = agent_card
+        # 规范化的 JSON，相同内容总是得到相同的字节与 ETag
+        self.body = canonical_agent_card_bytes(agent_card)
+        self.etag = hashlib.sha256(self.body).hexdigest()
+
+
 class A2aServerEndpoint(Endpoint):
     """
     A2A 协议统一端点
@@ -51,7 +89,7 @@ class A2aServerEndpoint(Endpoint):
         logger.info(f"A2A Plugin received: {method} {r.path}")
         
         if method == "GET":
-            return self._handle_agent_card(settings)
+            return self._handle_agent_card(r, settings)
         elif method == "POST":
             return self._handle_jsonrpc(r, settings)
         else:
@@ -60,17 +98,33 @@ class A2aServerEndpoint(Endpoint):
                 status=405
             )
 
-    def _handle_agent_card(self, settings: Mapping) -> Response:
-        """处理 GET 请求，返回 Agent Card 并根据配置注册到 Nacos"""
+    def _handle_agent_card(self, r: Request, settings: Mapping) -> Response:
+        """
+        处理 GET 请求，返回 Agent Card 并根据配置注册到 Nacos
+
+        序列化后的 Agent Card 按配置指纹缓存，带 ETag 和 Cache-Control，
+        客户端携带匹配的 If-None-Match 时返回 304。
+        """
         try:
-            agent_card = self._build_agent_card(settings)
+            card_response = self._get_agent_card_response(settings)
             
             # 根据用户配置决定是否注册到 Nacos
-            self._try_register_to_nacos(agent_card, settings)
+            self._try_register_to_nacos(card_response, settings)
             
-            return self._json_response(
-                agent_card.model_dump(mode='json', exclude_none=True)
-            )
+            headers = {
+                'Cache-Control': f'public, max-age={AGENT_CARD_MAX_AGE_SECONDS}',
+            }
+            if r.if_none_match.contains(card_response.etag):
+                response = Response(status=304, headers=headers)
+            else:
+                response = Response(
+                    card_response.body,
+                    status=200,
+                    headers=headers,
+                    content_type='application/json',
+                )
+            response.set_etag(card_response.etag)
+            return response
         except Exception as e:
             logger.exception("Error building Agent Card")
             return self._json_response(
@@ -78,13 +132,13 @@ class A2aServerEndpoint(Endpoint):
                 status=500
             )
 
-    def _try_register_to_nacos(self, agent_card: AgentCard, settings: Mapping) -> None:
+    def _try_register_to_nacos(self, card_response: 'AgentCardResponse', settings: Mapping) -> None:
         """
         尝试将 AgentCard 注册到 Nacos
         
         根据用户配置的 enable_nacos_registry 开关决定是否注册。
-        使用缓存避免频繁查询和注册，只有当 AgentCard 变更时才注册。
-        注册失败不影响 Agent Card 的正常返回。
+        注册由后台协调器异步完成，只有当 AgentCard 变更时才注册，
+        本方法立即返回，注册失败不影响 Agent Card 的正常返回。
         """
         # 检查是否启用 Nacos 注册
         enable_nacos = settings.get('enable_nacos_registry', True)
@@ -105,111 +159,48 @@ class A2aServerEndpoint(Endpoint):
         access_key = settings.get('nacos_accessKey', '') or ''
         secret_key = settings.get('nacos_secretKey', '') or ''
         
-        try:
-            # 1. 从缓存获取已注册的 AgentCard（缓存过期会自动从 Nacos 获取）
-            cached_card = get_cached_agent_card(
-                session=self.session,
-                nacos_addr=nacos_addr,
-                namespace_id=namespace_id,
-                agent_name=agent_card.name,
-                version=agent_card.version,
-                username=username,
-                password=password,
-                access_key=access_key,
-                secret_key=secret_key
-            )
-            
-            # 2. 判断是否需要注册（比较 name, description, url）
-            if not needs_registration(agent_card, cached_card):
-                print(f"[A2A] Agent '{agent_card.name}' already registered, skipping")
-                return
-            
-            # 3. 执行注册
-            asyncio.run(register_agent_card(
-                agent_card=agent_card,
+        # 提交给后台协调器，注册在后台进行，失败会自动重试
+        nacos_registrar.submit(
+            agent_card=card_response.agent_card,
+            fingerprint=card_response.etag,
+            target=NacosTarget(
                 nacos_addr=nacos_addr,
                 namespace_id=namespace_id,
                 username=username,
                 password=password,
                 access_key=access_key,
                 secret_key=secret_key,
-            ))
-            
-            # 4. 注册成功后从 Nacos 查询并更新缓存
-            remote_card = asyncio.run(get_agent_card(
-                agent_name=agent_card.name,
-                version=agent_card.version,
-                nacos_addr=nacos_addr,
-                namespace_id=namespace_id,
-                username=username,
-                password=password,
-                access_key=access_key,
-                secret_key=secret_key,
-            ))
-            
-            if remote_card:
-                set_cached_agent_card(
-                    session=self.session,
-                    nacos_addr=nacos_addr,
-                    namespace_id=namespace_id,
-                    agent_card=remote_card
-                )
-            
-            print(f"[A2A] Successfully registered agent '{agent_card.name}' to Nacos at {nacos_addr}")
-            logger.info(f"Agent '{agent_card.name}' registered to Nacos at {nacos_addr}")
-            
-        except Exception as e:
-            # 注册失败不影响正常流程，仅记录日志
-            print(f"[A2A] Nacos registration failed (non-blocking): {e}")
-            logger.warning(f"Failed to register agent card to Nacos: {e}")
+            ),
+            session=self.session,
+        )
 
     def _handle_jsonrpc(self, r: Request, settings: Mapping) -> Response:
-        """处理 POST 请求，JSON-RPC 调用"""
+        """
+        处理 POST 请求，JSON-RPC 调用
+
+        Session 只在请求期间有效：响应体发出后，请求在结束前等待本次请求
+        启动的、仍在使用 Session 的后台任务（如非阻塞 message/send 的执行）。
+        """
+        scope = SessionScope(self.session)
         try:
-            # 1. 解析 JSON-RPC 请求
-            request_data = r.get_json(force=True)
+            # 1. 解析 JSON-RPC 请求（只解析一次，交给适配器复用）
+            request_data = parse_json_body(r)
             logger.debug(f"JSON-RPC request: {request_data}")
             
-            # 2. 创建 Starlette 请求适配器
-            starlette_request = StarletteRequestAdapter(r)
+            # 2. 创建 Starlette 请求适配器，Session 随调用上下文传给执行器
+            starlette_request = StarletteRequestAdapter(r, json_data=request_data)
+            starlette_request.state[SESSION_STATE_KEY] = scope
             
-            # 3. 获取 App 配置
-            app_config = settings.get('app', {})
-            app_id = app_config.get('app_id', '')
-            
-            # 4. 创建会话管理器
-            conversation_manager = ConversationManager(
-                session=self.session,
-                app_id=app_id,
-            )
+            # 3. 获取（或创建）当前配置对应的 A2A 应用
+            app = self._get_application(settings)
             
-            # 5. 创建执行器
-            agent_executor = DifyAppAgentExecutor(
-                session=self.session,
-                app_config=app_config,
-                conversation_manager=conversation_manager,
-            )
-            
-            # 6. 创建请求处理器
-            request_handler = DefaultRequestHandler(
-                agent_executor=agent_executor,
-                task_store=InMemoryTaskStore(),
-            )
-            
-            # 7. 创建 A2A 应用
-            agent_card = self._build_agent_card(settings)
-            app = A2AStarletteApplication(
-                agent_card=agent_card,
-                http_handler=request_handler,
-            )
-            
-            # 8. 调用处理方法（异步转同步）
-            starlette_response = asyncio.run(
+            # 4. 在后台事件循环中调用处理方法
+            starlette_response = run_async(
                 app._handle_requests(starlette_request)
             )
             
-            # 9. 转换响应
-            return ResponseAdapter.to_werkzeug(starlette_response)
+            # 5. 转换响应
+            return ResponseAdapter.to_werkzeug(starlette_response, scope)
             
         except json.JSONDecodeError as e:
             return self._json_error_response(
@@ -219,12 +210,60 @@ class A2aServerEndpoint(Endpoint):
             )
         except Exception as e:
             logger.exception("Error handling JSON-RPC request")
+            run_async(scope.drain())
             return self._json_error_response(
                 code=-32603,
                 message="Internal error",
                 data=str(e)
             )
 
+    def _get_agent_card_response(self, settings: Mapping) -> AgentCardResponse:
+        """获取当前配置对应的 Agent Card 响应，按配置指纹缓存"""
+        key = settings_fingerprint(settings)
+        with _agent_card_responses_lock:
+            card_response = _agent_card_responses.get(key)
+            if card_response is not None:
+                _agent_card_responses.move_to_end(key)
+                return card_response
+            
+            card_response = AgentCardResponse(self._build_agent_card(settings))
+            _agent_card_responses[key] = card_response
+            while len(_agent_card_responses) > MAX_CACHED_APPLICATIONS:
+                _agent_card_responses.popitem(last=False)
+            return card_response
+
+    def _get_application(self, settings: Mapping) -> A2AStarletteApplication:
+        """
+        获取当前配置对应的 A2A 应用
+
+        应用、请求处理器和 TaskStore 按配置指纹缓存并在请求之间复用，
+        每次请求只需分发；配置变更后生成新的指纹，旧应用按 LRU 淘汰。
+        """
+        key = settings_fingerprint(settings)
+        with _applications_lock:
+            app = _applications.get(key)
+            if app is not None:
+                _applications.move_to_end(key)
+                return app
+            
+            app_config = settings.get('app', {})
+            agent_executor = DifyAppAgentExecutor(
+                app_config=app_config,
+            )
+            request_handler = DefaultRequestHandler(
+                agent_executor=agent_executor,
+                task_store=DifyStorageTaskStore(app_id=app_config.get('app_id', '')),
+            )
+            app = A2AStarletteApplication(
+                agent_card=self._get_agent_card_response(settings).agent_card,
+                http_handler=request_handler,
+                context_builder=DifyCallContextBuilder(),
+            )
+            _applications[key] = app
+            while len(_applications) > MAX_CACHED_APPLICATIONS:
+                _applications.popitem(last=False)
+            return app
+
     def _build_agent_card(self, settings: Mapping) -> AgentCard:
         """根据用户配置构建 AgentCard"""
         # 创建默认技能
@@ -238,7 +277,7 @@ class A2aServerEndpoint(Endpoint):
         
         # 创建能力声明（所有字段可选）
         capabilities = AgentCapabilities(
-            streaming=False,  # 不支持流式响应
+            streaming=True,  # 支持 message/stream（SSE）
             state_transition_history=False,
             push_notifications=False,
         )
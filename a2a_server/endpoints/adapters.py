@@ -5,11 +5,107 @@ Request/Response 适配器
 以便与 A2A SDK 集成。
 """
 
+import asyncio
 import json
-from typing import Any
+import logging
+from collections.abc import AsyncIterator, Iterable, Iterator
+from typing import Any, Optional
 
+from a2a.server.apps.jsonrpc.jsonrpc_app import DefaultCallContextBuilder
+from a2a.server.context import ServerCallContext
+from dify_plugin.config.logger_format import plugin_logger_handler
+from sse_starlette.sse import EventSourceResponse, ensure_bytes
 from werkzeug.wrappers import Request, Response
 
+from .utils import run_async
+
+logger = logging.getLogger(__name__)
+logger.addHandler(plugin_logger_handler)
+
+# SessionScope 在请求 state 与 ServerCallContext.state 中的键名
+SESSION_STATE_KEY = 'dify_session'
+
+# 请求结束前等待后台任务的最长时间，超时后取消这些任务。
+# 非阻塞的 message/send 先返回任务，但 Dify App 通过请求的 Session 调用，
+# 请求仍会保持到运行结束
+SESSION_DRAIN_TIMEOUT_SECONDS = 300
+# 取消后等待任务退出的时间
+SESSION_CANCEL_GRACE_SECONDS = 5
+
+# 逐跳头部不能透传给流式响应
+HOP_BY_HOP_HEADERS = frozenset({'connection', 'keep-alive', 'transfer-encoding'})
+
+
+class URLAdapter:
+    """Starlette URL 接口，提供 path 和 scheme"""
+    
+    __slots__ = ('_request',)
+    
+    def __init__(self, werkzeug_request: Request):
+        self._request = werkzeug_request
+    
+    @property
+    def path(self) -> str:
+        return self._request.path
+    
+    @property
+    def scheme(self) -> str:
+        return self._request.scheme
+
+
+class HeadersAdapter:
+    """Starlette Headers 接口，直接代理 Werkzeug Headers（大小写不敏感）"""
+    
+    __slots__ = ('_headers',)
+    
+    def __init__(self, werkzeug_headers):
+        self._headers = werkzeug_headers
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._headers.get(key, default)
+    
+    def getlist(self, key: str) -> list[str]:
+        return self._headers.getlist(key)
+    
+    def __getitem__(self, key: str) -> str:
+        """Support dict(headers) and headers[key]"""
+        value = self._headers.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+    
+    def __iter__(self):
+        return iter(self._headers.keys())
+    
+    def __len__(self):
+        return len(self._headers)
+    
+    def items(self):
+        return self._headers.items()
+    
+    def keys(self):
+        return self._headers.keys()
+    
+    def values(self):
+        return self._headers.values()
+
+
+class UnauthenticatedUserAdapter:
+    """未认证用户（Dify Endpoint 不提供用户认证）"""
+    
+    __slots__ = ()
+    
+    @property
+    def is_authenticated(self) -> bool:
+        return False
+    
+    @property
+    def display_name(self) -> str:
+        return "anonymous"
+
+
+UNAUTHENTICATED_USER = UnauthenticatedUserAdapter()
+
 
 class StarletteRequestAdapter:
     """
@@ -17,98 +113,35 @@ class StarletteRequestAdapter:
     
     A2A SDK 使用 Starlette 框架，而 Dify Plugin 使用 Werkzeug。
     此适配器提供 Starlette Request 所需的属性和方法接口。
+    
+    调用方已经解析过请求体时通过 json_data 传入，避免重复解析；
+    url 和 headers 适配器在创建时构建一次并复用。
     """
     
-    def __init__(self, werkzeug_request: Request):
+    __slots__ = ('_request', '_json_data', '_state', 'url', 'headers')
+    
+    def __init__(self, werkzeug_request: Request, json_data: Any = None):
         self._request = werkzeug_request
-        self._json_data = None
+        self._json_data = json_data
         self._state = {}
+        self.url = URLAdapter(werkzeug_request)
+        self.headers = HeadersAdapter(werkzeug_request.headers)
     
     @property
     def method(self) -> str:
         """HTTP 方法"""
         return self._request.method
     
-    @property
-    def url(self):
-        """URL 对象，需要提供 path 属性"""
-        class URLAdapter:
-            def __init__(self, werkzeug_request):
-                self._request = werkzeug_request
-            
-            @property
-            def path(self) -> str:
-                return self._request.path
-            
-            @property
-            def scheme(self) -> str:
-                return self._request.scheme
-        
-        return URLAdapter(self._request)
-    
-    @property
-    def headers(self):
-        """请求头，需要支持 get() 和 getlist() 方法"""
-        class HeadersAdapter:
-            def __init__(self, werkzeug_headers):
-                self._headers = werkzeug_headers
-            
-            def get(self, key: str, default: Any = None) -> Any:
-                return self._headers.get(key, default)
-            
-            def getlist(self, key: str) -> list[str]:
-                return self._headers.getlist(key)
-            
-            def __getitem__(self, key: str) -> str:
-                """Support dict(headers) and headers[key]"""
-                value = self._headers.get(key)
-                if value is None:
-                    raise KeyError(key)
-                return value
-            
-            def __iter__(self):
-                return iter(self._headers.keys())
-            
-            def __len__(self):
-                return len(list(self._headers.keys()))
-            
-            def items(self):
-                return self._headers.items()
-            
-            def keys(self):
-                return self._headers.keys()
-            
-            def values(self):
-                return self._headers.values()
-        
-        return HeadersAdapter(self._request.headers)
-    
     async def json(self) -> dict | list:
-        """解析 JSON body（异步方法）"""
+        """解析 JSON body（异步方法），请求体只解析一次"""
         if self._json_data is None:
-            try:
-                self._json_data = self._request.get_json(force=True)
-            except Exception as e:
-                raise json.JSONDecodeError(
-                    f"Failed to parse JSON: {e}",
-                    doc=str(self._request.get_data()),
-                    pos=0
-                )
+            self._json_data = parse_json_body(self._request)
         return self._json_data
     
     @property
-    def user(self):
+    def user(self) -> UnauthenticatedUserAdapter:
         """用户对象（认证相关）"""
-        class UnauthenticatedUserAdapter:
-            @property
-            def is_authenticated(self) -> bool:
-                return False
-            
-            @property
-            def display_name(self) -> str:
-                return "anonymous"
-        
-        return UnauthenticatedUserAdapter()
+        return UNAUTHENTICATED_USER
     
     @property
     def auth(self):
@@ -121,34 +154,170 @@ class StarletteRequestAdapter:
         return self._state
 
 
+def parse_json_body(werkzeug_request: Request) -> Any:
+    """
+    直接从原始字节解析 JSON 请求体
+
+    Raises:
+        json.JSONDecodeError: 请求体不是合法的 JSON
+    """
+    try:
+        return json.loads(werkzeug_request.get_data())
+    except UnicodeDecodeError as e:
+        raise json.JSONDecodeError(f"Request body is not valid UTF-8: {e}", doc='', pos=e.start)
+
+
+class SessionScope:
+    """
+    一次请求的 Dify Plugin Session 及仍在使用它的后台任务
+
+    Session 只在请求期间有效，而非阻塞的 message/send 在响应返回后、
+    message/stream 在客户端断开后，任务仍在后台执行。执行器和 TaskStore
+    通过 session 属性取得 Session，并用 track() 登记使用它的任务；
+    端点在请求结束前调用 drain() 等待这些任务完成。drain() 之后
+    session 为 None，迟到的写入只保留在内存中。
+
+    除构造外，所有方法都必须在后台事件循环中调用。
+    """
+
+    __slots__ = ('_session', '_tasks', '_closed')
+
+    def __init__(self, session):
+        self._session = session
+        self._tasks: set[asyncio.Task] = set()
+        self._closed = False
+
+    @property
+    def session(self):
+        """当前请求的 Session，请求结束后为 None"""
+        return None if self._closed else self._session
+
+    def track(self) -> None:
+        """登记当前任务正在使用 Session，请求结束前会等待它完成"""
+        task = asyncio.current_task()
+        if task is None or self._closed or task in self._tasks:
+            return
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self, timeout: float = SESSION_DRAIN_TIMEOUT_SECONDS) -> None:
+        """等待登记的任务完成，超时后取消它们，然后关闭 Session"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            while True:
+                # 让刚被唤醒的任务（例如继续消费事件的后台任务）有机会登记
+                await asyncio.sleep(0)
+                pending = [task for task in self._tasks if not task.done()]
+                if not pending:
+                    return
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    logger.warning(f"Cancelling {len(pending)} tasks still using the Dify session "
+                                   f"after {timeout}s")
+                    for task in pending:
+                        task.cancel()
+                    await asyncio.wait(pending, timeout=SESSION_CANCEL_GRACE_SECONDS)
+                    return
+                await asyncio.wait(pending, timeout=remaining)
+        finally:
+            self._closed = True
+
+
+def get_session_scope(call_context: Optional[ServerCallContext]) -> Optional[SessionScope]:
+    """从 ServerCallContext 中取出当前请求的 SessionScope"""
+    return call_context.state.get(SESSION_STATE_KEY) if call_context else None
+
+
+def _drain_after(body: Iterable[bytes], scope: SessionScope) -> Iterator[bytes]:
+    """先发出响应体，再在请求结束前等待仍在使用 Session 的后台任务"""
+    try:
+        yield from body
+    finally:
+        run_async(scope.drain())
+
+
+class DifyCallContextBuilder(DefaultCallContextBuilder):
+    """
+    构建 ServerCallContext 时附带当前请求的 SessionScope
+
+    A2A 应用在多次请求之间复用，而 Session 每次请求都不同，
+    因此不能保存在执行器中，而是随调用上下文传递给执行器。
+    """
+
+    def build(self, request) -> ServerCallContext:
+        call_context = super().build(request)
+        call_context.state[SESSION_STATE_KEY] = request.state.get(SESSION_STATE_KEY)
+        return call_context
+
+
+async def _next_event(body_iterator: AsyncIterator) -> tuple[bool, Any]:
+    try:
+        return False, await body_iterator.__anext__()
+    except StopAsyncIteration:
+        return True, None
+
+
+def _iter_sse(body_iterator: AsyncIterator, sep: str) -> Iterator[bytes]:
+    """
+    在请求线程中逐个取出后台事件循环上的 SSE 事件并编码为字节
+
+    客户端断开时生成器被关闭，同时关闭 A2A 的事件流。
+    """
+    try:
+        while True:
+            done, data = run_async(_next_event(body_iterator))
+            if done:
+                return
+            yield ensure_bytes(data, sep)
+    finally:
+        aclose = getattr(body_iterator, 'aclose', None)
+        if aclose is not None:
+            run_async(aclose())
+
+
 class ResponseAdapter:
     """将 Starlette Response 转换为 Werkzeug Response"""
     
     @staticmethod
-    def to_werkzeug(starlette_response) -> Response:
-        """转换 Starlette Response 到 Werkzeug Response"""
-        # 处理 JSONResponse
-        if hasattr(starlette_response, 'body'):
-            body = starlette_response.body
-            if isinstance(body, bytes):
-                body = body.decode('utf-8')
-        else:
-            body = ""
-        
-        # 提取状态码
-        status_code = getattr(starlette_response, 'status_code', 200)
+    def to_werkzeug(starlette_response, scope: Optional[SessionScope] = None) -> Response:
+        """
+        转换 Starlette Response 到 Werkzeug Response
+
+        传入 scope 时，响应体发出后、请求结束前等待仍在使用 Session 的后台任务。
+        """
+        # 处理 EventSourceResponse（message/stream、tasks/resubscribe）
+        if isinstance(starlette_response, EventSourceResponse):
+            return ResponseAdapter.to_werkzeug_stream(starlette_response, scope)
         
-        # 提取响应头
-        headers = {}
-        if hasattr(starlette_response, 'headers'):
-            headers = dict(starlette_response.headers)
+        # 处理 JSONResponse：body 已是编码好的字节，原样透传
+        body = getattr(starlette_response, 'body', b'')
         
-        # 确定 content-type
-        content_type = headers.get('content-type', 'application/json')
+        # 响应头使用原始的 (name, value) 列表，其中已包含 content-type 和 content-length
+        headers = [
+            (key.decode('latin-1'), value.decode('latin-1'))
+            for key, value in getattr(starlette_response, 'raw_headers', ())
+        ]
         
         return Response(
-            response=body,
-            status=status_code,
+            response=body if scope is None else _drain_after((body,), scope),
+            status=getattr(starlette_response, 'status_code', 200),
+            headers=headers,
+            direct_passthrough=True,
+        )
+
+    @staticmethod
+    def to_werkzeug_stream(starlette_response: EventSourceResponse,
+                           scope: Optional[SessionScope] = None) -> Response:
+        """转换 EventSourceResponse 到流式 Werkzeug Response，每个事件产生即发送"""
+        headers = [
+            (key, value) for key, value in starlette_response.headers.items()
+            if key.lower() not in HOP_BY_HOP_HEADERS
+        ]
+        events = _iter_sse(starlette_response.body_iterator, starlette_response.sep)
+        return Response(
+            response=events if scope is None else _drain_after(events, scope),
+            status=starlette_response.status_code,
             headers=headers,
-            content_type=content_type
+            direct_passthrough=True,
         )
@@ -2,10 +2,16 @@
 会话管理器
 
 维护 A2A contextId 到 Dify conversation_id 的映射，
-使用 Dify Plugin Storage (KV) 进行持久化存储。
+使用 Dify Plugin Storage (KV) 进行持久化存储，
+进程内 LRU 缓存映射，新映射延迟批量写入，并按 TTL 回收过期映射。
 """
 
+import json
 import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
 from typing import Optional
 
 from dify_plugin.config.logger_format import plugin_logger_handler
@@ -13,53 +19,203 @@ from dify_plugin.config.logger_format import plugin_logger_handler
 logger = logging.getLogger(__name__)
 logger.addHandler(plugin_logger_handler)
 
+# 会话映射的有效期，每次使用都会顺延
+CONVERSATION_TTL_SECONDS = 7 * 24 * 60 * 60
+# 内存中缓存的映射数量上限
+MAX_CACHED_CONVERSATIONS = 4096
+# 两次清理过期映射的最小间隔
+CONVERSATION_GC_INTERVAL_SECONDS = 5 * 60
+
+
+class _Mapping:
+    """缓存中的一条会话映射"""
+
+    __slots__ = ('conversation_id', 'expires_at', 'stored_expires_at', 'dirty')
+
+    def __init__(self, conversation_id: str, expires_at: float, stored_expires_at: float, dirty: bool):
+        self.conversation_id = conversation_id
+        self.expires_at = expires_at
+        # 存储中记录的过期时间
+        self.stored_expires_at = stored_expires_at
+        # 是否需要写入存储
+        self.dirty = dirty
+
+
+class ConversationCache:
+    """
+    进程级的会话映射 LRU 缓存
+
+    命中时不访问存储；新映射及需要顺延过期时间的映射标记为 dirty，
+    由使用它们的请求在 flush() 时写入存储。
+    同时按 App 记录已写入、尚未合并到存储索引的映射及清理状态。
+    """
+
+    def __init__(self, max_entries: int = MAX_CACHED_CONVERSATIONS):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, _Mapping] = OrderedDict()
+        # app_id -> {context_id: 过期时间}
+        self._pending_index: dict[str, dict[str, float]] = {}
+        self._gc_running: set[str] = set()
+        self._last_gc: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            entry.expires_at = now + CONVERSATION_TTL_SECONDS
+            # 存储中的剩余有效期不足一半时才写回，避免每条消息都写存储
+            if entry.stored_expires_at - now < CONVERSATION_TTL_SECONDS / 2:
+                entry.dirty = True
+            return entry.conversation_id
+
+    def put(self, key: str, conversation_id: str, stored_expires_at: float, dirty: bool) -> None:
+        now = time.time()
+        with self._lock:
+            self._entries[key] = _Mapping(
+                conversation_id, now + CONVERSATION_TTL_SECONDS, stored_expires_at, dirty)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                if evicted.dirty:
+                    # 尚未写入的映射不能丢，放回并停止淘汰
+                    self._entries[evicted_key] = evicted
+                    self._entries.move_to_end(evicted_key, last=False)
+                    break
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def take_dirty(self, keys: Iterable[str]) -> list[tuple[str, str, float]]:
+        """取出指定键中待写入的映射并清除 dirty 标记"""
+        with self._lock:
+            dirty = []
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry.dirty:
+                    entry.dirty = False
+                    entry.stored_expires_at = entry.expires_at
+                    dirty.append((key, entry.conversation_id, entry.expires_at))
+            return dirty
+
+    def mark_dirty(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.dirty = True
+
+
+    def add_to_index(self, app_id: str, context_id: str, expires_at: float) -> None:
+        """记录已写入存储的映射，在下次清理时合并到存储索引"""
+        with self._lock:
+            self._pending_index.setdefault(app_id, {})[context_id] = expires_at
+
+    def start_garbage_collection(self, app_id: str, now: float) -> Optional[dict[str, float]]:
+        """
+        距该 App 上次清理超过间隔且没有正在进行的清理时，
+        取出待合并的索引条目；否则返回 None
+        """
+        with self._lock:
+            last_gc = self._last_gc.setdefault(app_id, now)
+            if app_id in self._gc_running or now - last_gc < CONVERSATION_GC_INTERVAL_SECONDS:
+                return None
+            self._gc_running.add(app_id)
+            self._last_gc[app_id] = now
+            return self._pending_index.pop(app_id, {})
+
+    def finish_garbage_collection(self, app_id: str, unmerged: Optional[dict[str, float]] = None) -> None:
+        """结束清理，未能合并的条目放回，留待下次清理"""
+        with self._lock:
+            self._gc_running.discard(app_id)
+            if unmerged:
+                pending = self._pending_index.setdefault(app_id, {})
+                for context_id, expires_at in unmerged.items():
+                    pending.setdefault(context_id, expires_at)
+
+
+conversation_cache = ConversationCache()
+
+
 class ConversationManager:
     """
     会话管理器
     维护 A2A contextId 到 Dify conversation_id 的映射
-    
+
     使用 Dify Plugin Storage (KV) 进行持久化存储
     参考文档：https://docs.dify.ai/develop-plugin/features-and-specs/plugin-types/persistent-storage-kv
+
+    映射先查进程内的 conversation_cache，命中时不访问存储；
+    本管理器读取或保存过的映射在 flush() 时用本请求的 Session 写入存储，
+    不会写入其他请求（可能属于其他租户）的映射。
+    映射超过 CONVERSATION_TTL_SECONDS 未使用即过期：读取时删除，
+    同时已写入的映射记录在索引键中，flush() 定期清理其中过期的映射。
     """
-    
+
     KEY_PREFIX = "conv"
-    
-    def __init__(self, session, app_id: str):
+    INDEX_KEY_PREFIX = "convindex"
+
+    def __init__(self, session, app_id: str, cache: ConversationCache = conversation_cache):
         """
         初始化会话管理器
-        
+
         Args:
             session: Dify Plugin Session，用于访问存储
             app_id: Dify App ID，用于隔离不同 App 的会话
+            cache: 进程内的映射缓存
         """
         self.session = session
         self.app_id = app_id
-    
+        self.cache = cache
+        # 本管理器读取或保存过的映射，key -> contextId
+        self._keys: dict[str, str] = {}
+
     def _build_key(self, context_id: str) -> str:
         """构建存储键 - 格式: conv:{app_id}:{context_id}"""
-        return f"{self.KEY_PREFIX}:{self.app_id}:{context_id}"
-    
+        key = f"{self.KEY_PREFIX}:{self.app_id}:{context_id}"
+        self._keys[key] = context_id
+        return key
+
+    def _build_index_key(self) -> str:
+        """构建索引键 - 格式: convindex:{app_id}"""
+        return f"{self.INDEX_KEY_PREFIX}:{self.app_id}"
+
     def get_dify_conversation_id(self, a2a_context_id: str) -> Optional[str]:
         """
         根据 A2A contextId 获取 Dify conversation_id
-        
+
         Args:
             a2a_context_id: A2A 协议的 contextId
-            
+
         Returns:
-            Dify conversation_id，如果不存在返回 None
+            Dify conversation_id，如果不存在或已过期返回 None
         """
         if not a2a_context_id:
             return None
-        
+
         key = self._build_key(a2a_context_id)
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+
         try:
             # get() 返回 bytes 或 None
             value_bytes = self.session.storage.get(key)
             if value_bytes:
-                # 解码 bytes 为字符串
-                value = value_bytes.decode('utf-8')
+                value, expires_at = self._decode(value_bytes)
+                if expires_at is not None and expires_at <= time.time():
+                    logger.debug(f"Conversation mapping expired: {a2a_context_id}")
+                    self.session.storage.delete(key)
+                    return None
                 logger.debug(f"Found conversation mapping: {a2a_context_id} -> {value}")
+                # 旧格式没有过期时间，标记为待写入以补上
+                self.cache.put(key, value, expires_at or 0.0, dirty=expires_at is None)
                 return value
             else:
                 # 新会话，还没有映射记录
@@ -67,43 +223,126 @@ class ConversationManager:
         except Exception as e:
             # 只记录 debug，因为新会话获取失败是正常的
             logger.debug(f"No conversation mapping (new session): {e}")
-        
+
         return None
-    
+
+    def _stored_expires_at(self, key: str) -> Optional[float]:
+        """存储中映射的过期时间，映射不存在时返回 None，旧格式视为已过期"""
+        try:
+            value_bytes = self.session.storage.get(key)
+        except Exception:
+            # 键不存在时 get() 会抛出异常
+            return None
+        if not value_bytes:
+            return None
+        return self._decode(value_bytes)[1] or 0.0
+
+    @staticmethod
+    def _decode(value_bytes: bytes) -> tuple[str, Optional[float]]:
+        """解析存储的值，兼容只保存 conversation_id 的旧格式"""
+        value = value_bytes.decode('utf-8')
+        if value.startswith('{'):
+            data = json.loads(value)
+            return data['conversation_id'], data.get('expires_at')
+        return value, None
+
     def save_dify_conversation_id(
-        self, 
-        a2a_context_id: str, 
+        self,
+        a2a_context_id: str,
         dify_conversation_id: str
     ) -> bool:
         """
         保存 A2A contextId 到 Dify conversation_id 的映射
-        
+
+        映射立即在进程内生效，调用 flush() 后写入存储。
+
         Args:
             a2a_context_id: A2A 协议的 contextId
             dify_conversation_id: Dify 返回的 conversation_id
-            
+
         Returns:
             是否保存成功
         """
         if not a2a_context_id or not dify_conversation_id:
             return False
-        
+
         key = self._build_key(a2a_context_id)
+        self.cache.put(key, dify_conversation_id, 0.0, dirty=True)
+        logger.info(f"Saved conversation mapping: {a2a_context_id} -> {dify_conversation_id}")
+        return True
+
+    def flush(self) -> int:
+        """
+        将本管理器读取或保存过的待写入映射批量写入存储，并按间隔清理过期映射
+
+        Returns:
+            写入的映射数量
+        """
+        written = 0
+        for key, conversation_id, expires_at in self.cache.take_dirty(self._keys):
+            try:
+                # set() 的值必须是 bytes 格式
+                self.session.storage.set(key, json.dumps({
+                    'conversation_id': conversation_id,
+                    'expires_at': expires_at,
+                }).encode('utf-8'))
+                self.cache.add_to_index(self.app_id, self._keys[key], expires_at)
+                written += 1
+            except Exception as e:
+                logger.error(f"Failed to save conversation mapping: {e}")
+                self.cache.mark_dirty(key)
+
+        pending = self.cache.start_garbage_collection(self.app_id, time.time())
+        if pending is not None:
+            self._collect_garbage(pending)
+        return written
+
+    def _collect_garbage(self, pending: dict[str, float]) -> None:
+        """
+        合并本进程写入的映射到存储索引，并删除索引中已过期的映射
+
+        索引的读改写不是原子的，多个进程同时清理时可能丢失个别条目，
+        这些映射仍会在被读取时按过期时间删除。
+        """
+        index_key = self._build_index_key()
         try:
-            # set() 的值必须是 bytes 格式
-            self.session.storage.set(key, dify_conversation_id.encode('utf-8'))
-            logger.info(f"Saved conversation mapping: {a2a_context_id} -> {dify_conversation_id}")
-            return True
+            try:
+                index = json.loads(self.session.storage.get(index_key).decode('utf-8'))
+            except Exception:
+                index = {}
+            index.update(pending)
+
+            now = time.time()
+            expired = []
+            for context_id, expires_at in list(index.items()):
+                if expires_at > now:
+                    continue
+                key = f"{self.KEY_PREFIX}:{self.app_id}:{context_id}"
+                # 其他进程可能已顺延过期时间而尚未合并到索引，以存储中的值为准
+                stored_expires_at = self._stored_expires_at(key)
+                if stored_expires_at is not None and stored_expires_at > now:
+                    index[context_id] = stored_expires_at
+                    continue
+                if stored_expires_at is not None:
+                    self.session.storage.delete(key)
+                    expired.append(context_id)
+                del index[context_id]
+            self.session.storage.set(index_key, json.dumps(index).encode('utf-8'))
+            pending = None
+            if expired:
+                logger.info(f"Removed {len(expired)} expired conversation mappings of app {self.app_id}")
         except Exception as e:
-            logger.error(f"Failed to save conversation mapping: {e}")
-            return False
-    
+            logger.warning(f"Failed to collect expired conversation mappings: {e}")
+        finally:
+            self.cache.finish_garbage_collection(self.app_id, pending)
+
     def delete_conversation_mapping(self, a2a_context_id: str) -> bool:
         """删除会话映射（可选，用于清理）"""
         if not a2a_context_id:
             return False
-        
+
         key = self._build_key(a2a_context_id)
+        self.cache.discard(key)
         try:
             self.session.storage.delete(key)
             logger.info(f"Deleted conversation mapping: {a2a_context_id}")
@@ -4,19 +4,80 @@ Dify App 执行器
 将 A2A 请求转换为 Dify App 调用，支持会话管理。
 """
 
+import asyncio
 import logging
+import threading
+from collections.abc import AsyncIterator, Generator
 from typing import Optional
+from uuid import uuid4
 
 from a2a.server.agent_execution import AgentExecutor, RequestContext
 from a2a.server.events import EventQueue
-from a2a.utils import new_agent_text_message
+from a2a.server.tasks import TaskUpdater
+from a2a.types import Part, TaskNotCancelableError, TextPart
+from a2a.utils import new_agent_text_message, new_task
+from a2a.utils.errors import ServerError
 from dify_plugin.config.logger_format import plugin_logger_handler
 
+from .adapters import get_session_scope
 from .conversation import ConversationManager
+from .utils import get_app_invoke_executor
 
 logger = logging.getLogger(__name__)
 logger.addHandler(plugin_logger_handler)
 
+# Dify App 类型，对应调用的接口；Chatbot/Agent/Chatflow 都使用 chat 接口
+APP_TYPE_CHAT = 'chat'
+APP_TYPE_WORKFLOW = 'workflow'
+APP_TYPE_COMPLETION = 'completion'
+# 类型未知时的探测顺序
+APP_TYPES = (APP_TYPE_CHAT, APP_TYPE_WORKFLOW, APP_TYPE_COMPLETION)
+
+# 按 app_id 记住探测到的 App 类型（App 创建后类型不会改变）
+_app_types: dict[str, str] = {}
+
+
+async def iter_in_thread(chunks: Generator, stop: threading.Event) -> AsyncIterator:
+    """
+    在读取 Dify App 回答的专用线程池中消费同步生成器，逐段交给事件循环
+
+    生成器只在一个线程中运行，结束、出错或设置 stop 后在同一线程中关闭，
+    不再继续读取 Dify 的响应流。迭代提前结束（包括协程被取消）时自动设置 stop。
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def produce() -> None:
+        try:
+            for chunk in chunks:
+                loop.call_soon_threadsafe(queue.put_nowait, (False, chunk))
+                if stop.is_set():
+                    break
+        except BaseException as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (True, e))
+        else:
+            loop.call_soon_threadsafe(queue.put_nowait, (True, None))
+        finally:
+            chunks.close()
+
+    loop.run_in_executor(get_app_invoke_executor(), produce)
+    finished = False
+    try:
+        while True:
+            done, value = await queue.get()
+            if done:
+                finished = True
+                if value is not None:
+                    raise value
+                return
+            if stop.is_set():
+                return
+            yield value
+    finally:
+        if not finished:
+            stop.set()
+
+
 class DifyAppAgentExecutor(AgentExecutor):
     """
     Dify App 执行器
@@ -26,25 +87,24 @@ class DifyAppAgentExecutor(AgentExecutor):
     - Chatbot/Agent/Chatflow (chat) - 使用 session.app.chat.invoke()
     - Workflow - 使用 session.app.workflow.invoke()
     - Completion - 使用 session.app.completion.invoke()
+    
+    App 类型在首次调用时探测并按 app_id 记住，之后每个请求只调用一次 Dify。
+
+    执行器随 A2A 应用在多次请求之间复用，Dify Plugin Session
+    通过 ServerCallContext.state 中的 SessionScope 按请求传入；
+    执行在后台继续时（如非阻塞 message/send），请求等待执行完成后才结束。
     """
 
-    def __init__(
-        self, 
-        session, 
-        app_config: dict,
-        conversation_manager: ConversationManager
-    ):
+    def __init__(self, app_config: dict):
         """
         初始化 Dify App 执行器
         
         Args:
-            session: Dify Plugin Session
             app_config: app-selector 返回的 App 配置对象
-            conversation_manager: 会话管理器
         """
-        self.session = session
         self.app_id = app_config.get('app_id', '')
-        self.conversation_manager = conversation_manager
+        # 本进程中正在执行的任务，task_id -> (停止读取回答的信号, 任务的 TaskUpdater)
+        self._running: dict[str, tuple[threading.Event, TaskUpdater]] = {}
 
     async def execute(
         self,
@@ -54,26 +114,114 @@ class DifyAppAgentExecutor(AgentExecutor):
         """
         执行 A2A 请求，调用 Dify App
         
+        以 Task 的形式返回结果：working -> 产物 answer -> completed，
+        任务保存在 TaskStore 中，客户端可以通过 tasks/get 查询。
+        message/stream 请求中 Dify 的每个回答片段都作为追加的产物
+        片段（TaskArtifactUpdateEvent）立即发出。
+        
+        Dify 的同步调用在线程池中进行，多个任务可以同时执行；
+        任务被取消后停止读取回答，不再发出 completed。
+        
         Args:
             context: A2A 请求上下文，包含用户消息
             event_queue: 事件队列，用于返回响应
         """
+        # 在发出第一个事件前登记，非阻塞请求在执行完成前不会结束
+        scope = get_session_scope(context.call_context)
+        if scope is not None:
+            scope.track()
+        task = context.current_task
+        if task is None:
+            try:
+                task = new_task(context.message)
+            except Exception as e:
+                logger.warning(f"Invalid message for Dify App {self.app_id}: {e}")
+                await event_queue.enqueue_event(
+                    new_agent_text_message(f"Error: {str(e)}")
+                )
+                return
+            await event_queue.enqueue_event(task)
+        updater = TaskUpdater(event_queue, task.id, task.context_id)
+        conversation_manager = None
+        stop = threading.Event()
+        self._running[task.id] = (stop, updater)
+        
         try:
+            await updater.start_work()
+            
             # 1. 从 context 中提取用户消息
             user_message = self._extract_user_message(context)
             logger.info(f"Received message for Dify App {self.app_id}: {user_message[:100]}...")
             
-            # 2. 调用 Dify App
-            result = self._call_app(user_message, context)
+            # 2. 调用 Dify App（同步阻塞调用，在线程池中读取以免阻塞事件循环）
+            session = self._get_session(context)
+            conversation_manager = ConversationManager(
+                session=session,
+                app_id=self.app_id,
+            )
+            chunks = iter_in_thread(
+                self._call_app(session, conversation_manager, user_message, context), stop)
             
-            # 3. 将结果封装为 A2A 消息并返回
-            await event_queue.enqueue_event(new_agent_text_message(result))
+            # 3. 将结果作为任务产物返回并结束任务
+            if self._is_streaming(context):
+                await self._stream_answer(updater, chunks, stop)
+            else:
+                answer_parts = [chunk async for chunk in chunks]
+                if stop.is_set():
+                    return
+                await updater.add_artifact(
+                    [Part(root=TextPart(text=''.join(answer_parts) or 'No response'))],
+                    name='answer',
+                )
+            # 已取消的任务由 cancel() 发出 canceled 状态
+            if not stop.is_set():
+                await updater.complete()
             
         except Exception as e:
             logger.exception(f"Error executing Dify App {self.app_id}")
-            await event_queue.enqueue_event(
-                new_agent_text_message(f"Error: {str(e)}")
+            await updater.failed(updater.new_agent_message(
+                [Part(root=TextPart(text=f"Error: {str(e)}"))]
+            ))
+        finally:
+            stop.set()
+            self._running.pop(task.id, None)
+            # 回答发出后再批量写入新的会话映射，不占用响应时间；
+            # 请求在执行完成前不会结束，超时被取消时 Session 已关闭
+            if conversation_manager is not None and scope.session is not None:
+                await asyncio.to_thread(conversation_manager.flush)
+
+    async def _stream_answer(
+        self,
+        updater: TaskUpdater,
+        chunks: AsyncIterator[str],
+        stop: threading.Event,
+    ) -> None:
+        """
+        将回答片段逐个作为同一产物的追加片段立即发出
+
+        流的结束由随后的 completed 状态事件表示。
+        """
+        artifact_id = str(uuid4())
+        append = False
+        async for chunk in chunks:
+            await updater.add_artifact(
+                [Part(root=TextPart(text=chunk))],
+                artifact_id=artifact_id,
+                name='answer',
+                append=append,
             )
+            append = True
+        if not append and not stop.is_set():
+            await updater.add_artifact(
+                [Part(root=TextPart(text='No response'))],
+                artifact_id=artifact_id,
+                name='answer',
+            )
+
+    def _is_streaming(self, context: RequestContext) -> bool:
+        """是否为 message/stream 请求（JSON-RPC 方法名由 A2A 应用写入调用上下文）"""
+        call_context = context.call_context
+        return bool(call_context) and call_context.state.get('method') == 'message/stream'
 
     def _extract_user_message(self, context: RequestContext) -> str:
         """
@@ -96,6 +244,14 @@ class DifyAppAgentExecutor(AgentExecutor):
             return '\n'.join(text_parts) if text_parts else ''
         return ''
     
+    def _get_session(self, context: RequestContext):
+        """从 ServerCallContext 中取出当前请求的 Dify Plugin Session"""
+        scope = get_session_scope(context.call_context)
+        session = scope.session if scope is not None else None
+        if session is None:
+            raise RuntimeError('Dify session is missing from the call context')
+        return session
+
     def _get_context_id(self, context: RequestContext) -> str:
         """从 A2A RequestContext 中提取 contextId"""
         # 优先使用 context_id
@@ -107,68 +263,113 @@ class DifyAppAgentExecutor(AgentExecutor):
                 return context.task.context_id or ''
         return ''
 
-    def _call_app(self, user_message: str, context: RequestContext) -> str:
+    def _call_app(
+        self,
+        session,
+        conversation_manager: ConversationManager,
+        user_message: str,
+        context: RequestContext
+    ) -> Generator[str, None, None]:
         """
-        调用 Dify App（支持会话管理）
+        调用 Dify App（支持会话管理），逐段产出回答
         
-        注意：Agent Chat App 不支持 blocking 模式，必须使用 streaming
+        App 类型已知时只调用对应的接口；首次调用时按 chat -> workflow ->
+        completion 的顺序探测，成功后按 app_id 记住类型。
         """
+        app_type = _app_types.get(self.app_id)
+        if app_type is not None:
+            yield from self._invoke_app(app_type, session, conversation_manager, user_message, context)
+            return
+        
+        first_error = None
+        for app_type in APP_TYPES:
+            answered = False
+            try:
+                for chunk in self._invoke_app(app_type, session, conversation_manager, user_message, context):
+                    if not answered:
+                        answered = True
+                        _app_types[self.app_id] = app_type
+                    yield chunk
+            except Exception as e:
+                # 已经产出部分回答时不能再尝试其他接口，否则回答会重复
+                if answered:
+                    raise
+                logger.warning(f"{app_type} invoke failed for Dify App {self.app_id}: {e}")
+                first_error = first_error or e
+                continue
+            _app_types[self.app_id] = app_type
+            logger.info(f"Detected Dify App {self.app_id} as {app_type}")
+            return
+        raise first_error
+    
+    def _invoke_app(
+        self,
+        app_type: str,
+        session,
+        conversation_manager: ConversationManager,
+        user_message: str,
+        context: RequestContext
+    ) -> Generator[str, None, None]:
+        """按 App 类型调用一次 Dify App，逐段产出回答"""
+        if app_type == APP_TYPE_WORKFLOW:
+            # Workflow 接口（默认 blocking）
+            response = session.app.workflow.invoke(
+                app_id=self.app_id,
+                inputs={'query': user_message},
+                response_mode='blocking',
+            )
+            yield self._extract_workflow_response(response)
+            return
+        
+        if app_type == APP_TYPE_COMPLETION:
+            # Completion 接口没有会话，用户消息作为 query 变量传入
+            response_gen = session.app.completion.invoke(
+                app_id=self.app_id,
+                inputs={'query': user_message},
+                response_mode='streaming',
+            )
+            for chunk in response_gen:
+                if isinstance(chunk, dict) and chunk.get('answer'):
+                    yield chunk['answer']
+            return
+        
         # 1. 获取 A2A contextId
         a2a_context_id = self._get_context_id(context)
         
         # 2. 查找已有的 Dify conversation_id
         dify_conversation_id = ''
         if a2a_context_id:
-            dify_conversation_id = self.conversation_manager.get_dify_conversation_id(
+            dify_conversation_id = conversation_manager.get_dify_conversation_id(
                 a2a_context_id
             ) or ''
         
-        # 3. 调用 Dify App
-        try:
-            # Chat 接口（支持 Chatbot/Agent/Chatflow）
-            # Agent App 不支持 blocking，必须用 streaming
-            response_gen = self.session.app.chat.invoke(
-                app_id=self.app_id,
-                query=user_message,
-                inputs={},
-                response_mode='streaming',
-                conversation_id=dify_conversation_id or None,
+        # 3. Chat 接口（支持 Chatbot/Agent/Chatflow）
+        # Agent App 不支持 blocking，必须用 streaming
+        response_gen = session.app.chat.invoke(
+            app_id=self.app_id,
+            query=user_message,
+            inputs={},
+            response_mode='streaming',
+            conversation_id=dify_conversation_id or None,
+        )
+        
+        # 逐段产出流式响应
+        conversation_id = None
+        for chunk in response_gen:
+            if isinstance(chunk, dict):
+                # 提取 answer 片段
+                if chunk.get('answer'):
+                    yield chunk['answer']
+                # 提取 conversation_id
+                if 'conversation_id' in chunk and chunk['conversation_id']:
+                    conversation_id = chunk['conversation_id']
+        
+        # 4. 保存返回的 conversation_id（如果是新会话）
+        if a2a_context_id and conversation_id and conversation_id != dify_conversation_id:
+            conversation_manager.save_dify_conversation_id(
+                a2a_context_id, 
+                conversation_id
             )
-            
-            # 收集流式响应
-            result_text = ''
-            conversation_id = None
-            for chunk in response_gen:
-                if isinstance(chunk, dict):
-                    # 提取 answer 片段
-                    if 'answer' in chunk:
-                        result_text += chunk['answer']
-                    # 提取 conversation_id
-                    if 'conversation_id' in chunk and chunk['conversation_id']:
-                        conversation_id = chunk['conversation_id']
-            
-            # 4. 保存返回的 conversation_id（如果是新会话）
-            if a2a_context_id and conversation_id and conversation_id != dify_conversation_id:
-                self.conversation_manager.save_dify_conversation_id(
-                    a2a_context_id, 
-                    conversation_id
-                )
-            
-            return result_text or 'No response'
-            
-        except Exception as chat_error:
-            logger.warning(f"Chat invoke failed, trying workflow: {chat_error}")
-            try:
-                # Workflow 接口（默认 blocking）
-                response = self.session.app.workflow.invoke(
-                    app_id=self.app_id,
-                    inputs={'query': user_message},
-                    response_mode='blocking',
-                )
-                return self._extract_workflow_response(response)
-            except Exception as workflow_error:
-                logger.error(f"Workflow invoke also failed: {workflow_error}")
-                raise chat_error
     
     def _extract_conversation_id(self, response) -> Optional[str]:
         """从 Dify 响应中提取 conversation_id"""
@@ -199,5 +400,27 @@ class DifyAppAgentExecutor(AgentExecutor):
     async def cancel(
         self, context: RequestContext, event_queue: EventQueue
     ) -> None:
-        """取消执行（当前不支持）"""
-        raise Exception('Cancel operation is not supported')
+        """
+        取消执行
+
+        本进程中正在执行的任务停止读取 Dify 的回答流（当前片段读取完成后生效），
+        并将任务标记为 canceled。其他进程执行的任务无法在这里停止，
+        拒绝取消，以免其状态被本进程覆盖。
+
+        Raises:
+            ServerError: 任务不在本进程中执行（TaskNotCancelableError）
+        """
+        running = self._running.get(context.task_id)
+        if running is None:
+            raise ServerError(error=TaskNotCancelableError(
+                message=f'Task {context.task_id} is not running in this worker'))
+        stop, updater = running
+        stop.set()
+        # 在执行中的任务自己的事件队列上发出，本次请求订阅的队列及
+        # 正在等待该任务的 message/stream 都能收到 canceled 并结束
+        try:
+            await updater.cancel()
+        except RuntimeError:
+            # 任务恰好在此之前结束
+            raise ServerError(error=TaskNotCancelableError(
+                message=f'Task {context.task_id} has already finished'))
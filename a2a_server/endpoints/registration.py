@@ -0,0 +1,200 @@
+"""
+Nacos 注册协调器
+
+在后台事件循环中把 AgentCard 注册到 Nacos，Agent Card 的 GET 请求
+只提交期望的状态并立即返回。
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from a2a.types import AgentCard
+from dify_plugin.config.logger_format import plugin_logger_handler
+
+from .utils import (
+    get_agent_card,
+    get_event_loop,
+    get_registration_record,
+    needs_registration,
+    register_agent_card,
+    set_registration_record,
+)
+
+logger = logging.getLogger(__name__)
+logger.addHandler(plugin_logger_handler)
+
+# 提交后等待的时间，期间的多次提交合并为一次注册
+REGISTRATION_DEBOUNCE_SECONDS = 1
+# 注册失败后的重试间隔，按失败次数翻倍
+REGISTRATION_RETRY_INITIAL_SECONDS = 5
+REGISTRATION_RETRY_MAX_SECONDS = 300
+# 内容未变化时，向 Nacos 确认注册仍然存在的间隔
+REGISTRATION_VERIFY_SECONDS = 60 * 60
+
+
+class NacosTarget(NamedTuple):
+    """Nacos 连接参数"""
+    nacos_addr: str
+    namespace_id: str
+    username: str
+    password: str
+    access_key: str
+    secret_key: str
+
+
+class _Registration:
+    """一个 Agent 在一个 Nacos 上的注册状态"""
+
+    __slots__ = (
+        'target', 'desired', 'desired_fingerprint', 'registered_fingerprint',
+        'verified_at', 'loaded', 'persisted', 'scheduled', 'failures',
+    )
+
+    def __init__(self, target: NacosTarget):
+        self.target = target
+        self.desired: Optional[AgentCard] = None
+        self.desired_fingerprint: Optional[str] = None
+        self.registered_fingerprint: Optional[str] = None
+        self.verified_at = 0.0
+        # 是否已从插件存储读取注册记录
+        self.loaded = False
+        # 存储中的记录是否与 registered_fingerprint、verified_at 一致
+        self.persisted = True
+        self.scheduled = False
+        self.failures = 0
+
+
+class NacosRegistrar:
+    """
+    Nacos 注册协调器
+
+    - 本地判断：已注册 AgentCard 的内容指纹保存在插件存储的注册记录中，
+      指纹一致时不访问 Nacos，进程重启后也无需重新查询
+    - 防抖：提交后等待 REGISTRATION_DEBOUNCE_SECONDS，只注册最后一次提交的版本
+    - 重试：失败后按指数退避重试，直到成功或被更新的提交取代
+    - 校验：内容未变化时，每 REGISTRATION_VERIFY_SECONDS 向 Nacos 确认一次注册仍然存在
+
+    注册在后台事件循环中进行，而插件存储只能在请求期间通过 Session 访问，
+    因此注册记录在之后的 GET 请求中写回。
+    """
+
+    def __init__(self):
+        self._registrations: dict[tuple, _Registration] = {}
+        self._lock = threading.Lock()
+        # 事件循环只保留任务的弱引用，正在进行的协调任务保存在这里直到完成
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(self, agent_card: AgentCard, fingerprint: str, target: NacosTarget, session) -> None:
+        """
+        提交期望注册的 AgentCard，立即返回
+
+        除首次读取和写回注册记录外不做任何 I/O。
+
+        Args:
+            agent_card: 期望的 AgentCard
+            fingerprint: AgentCard 的内容指纹
+            target: Nacos 连接参数
+            session: 当前请求的 Dify Plugin Session，用于读写注册记录
+        """
+        key = (target, agent_card.name)
+        with self._lock:
+            registration = self._registrations.get(key)
+            if registration is None:
+                registration = self._registrations[key] = _Registration(target)
+        self._sync_record(registration, agent_card.name, session)
+
+        with self._lock:
+            registration.desired = agent_card
+            registration.desired_fingerprint = fingerprint
+            if registration.scheduled:
+                return
+            unchanged = not needs_registration(fingerprint, registration.registered_fingerprint)
+            if unchanged and time.time() - registration.verified_at < REGISTRATION_VERIFY_SECONDS:
+                return
+            registration.scheduled = True
+        get_event_loop().call_soon_threadsafe(self._schedule, key, REGISTRATION_DEBOUNCE_SECONDS)
+
+    def _sync_record(self, registration: _Registration, agent_name: str, session) -> None:
+        """首次使用时读取注册记录，后台注册或校验完成后写回"""
+        target = registration.target
+        with self._lock:
+            loaded = registration.loaded
+            persisted = registration.persisted
+            fingerprint = registration.registered_fingerprint
+            verified_at = registration.verified_at
+
+        if not loaded:
+            record = get_registration_record(session, target.nacos_addr, target.namespace_id, agent_name)
+            with self._lock:
+                if not registration.loaded:
+                    registration.loaded = True
+                    if record and registration.registered_fingerprint is None:
+                        registration.registered_fingerprint = record.get('fingerprint')
+                        registration.verified_at = record.get('verified_at', 0.0)
+        elif not persisted and fingerprint is not None:
+            if set_registration_record(session, target.nacos_addr, target.namespace_id,
+                                       agent_name, fingerprint, verified_at):
+                with self._lock:
+                    if (registration.registered_fingerprint == fingerprint
+                            and registration.verified_at == verified_at):
+                        registration.persisted = True
+
+    def _schedule(self, key: tuple, delay: float) -> None:
+        loop = asyncio.get_running_loop()
+        loop.call_later(delay, self._start_reconcile, key)
+
+    def _start_reconcile(self, key: tuple) -> None:
+        task = asyncio.get_running_loop().create_task(self._reconcile(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _reconcile(self, key: tuple) -> None:
+        with self._lock:
+            registration = self._registrations[key]
+            agent_card = registration.desired
+            fingerprint = registration.desired_fingerprint
+            changed = needs_registration(fingerprint, registration.registered_fingerprint)
+        target = registration.target
+
+        try:
+            if not changed:
+                # 内容未变化，只确认注册仍然存在
+                try:
+                    await get_agent_card(
+                        agent_name=agent_card.name,
+                        version=agent_card.version,
+                        **target._asdict(),
+                    )
+                except Exception as e:
+                    logger.warning(f"Agent '{agent_card.name}' not found in Nacos, registering again: {e}")
+                    changed = True
+            if changed:
+                await register_agent_card(agent_card=agent_card, **target._asdict())
+                logger.info(f"Agent '{agent_card.name}' registered to Nacos at {target.nacos_addr}")
+        except Exception as e:
+            with self._lock:
+                registration.failures += 1
+                delay = min(
+                    REGISTRATION_RETRY_INITIAL_SECONDS * 2 ** (registration.failures - 1),
+                    REGISTRATION_RETRY_MAX_SECONDS,
+                )
+            logger.warning(f"Failed to register agent card to Nacos, retrying in {delay}s: {e}")
+            self._schedule(key, delay)
+            return
+
+        with self._lock:
+            registration.registered_fingerprint = fingerprint
+            registration.verified_at = time.time()
+            registration.persisted = False
+            registration.failures = 0
+            # 协调期间又提交了新的版本
+            if registration.desired_fingerprint != fingerprint:
+                self._schedule(key, REGISTRATION_DEBOUNCE_SECONDS)
+            else:
+                registration.scheduled = False
+
+
+nacos_registrar = NacosRegistrar()
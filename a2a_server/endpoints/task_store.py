@@ -0,0 +1,341 @@
+"""
+Dify Storage TaskStore
+
+基于 Dify Plugin Storage (KV) 的 A2A TaskStore，
+前置有界的内存 LRU（写穿），按 TTL 回收过期任务，
+并限制任务在存储中占用的总字节数。
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from a2a.server.context import ServerCallContext
+from a2a.server.tasks import TaskStore
+from a2a.types import Task, TaskState
+from dify_plugin.config.logger_format import plugin_logger_handler
+
+from .adapters import get_session_scope
+
+logger = logging.getLogger(__name__)
+logger.addHandler(plugin_logger_handler)
+
+# 任务在存储中的保留时间，每次保存都会顺延
+TASK_TTL_SECONDS = 60 * 60
+# 到达终态的任务只需留给客户端取结果，保留时间更短
+TERMINAL_TASK_TTL_SECONDS = 10 * 60
+# 内存 LRU 中保留的任务数量上限
+MAX_CACHED_TASKS = 256
+# 单个任务序列化后的大小上限，超出时丢弃 history 后再尝试，仍然超出则只保留在内存中
+MAX_STORED_TASK_BYTES = 16 * 1024
+# 一个 App 的任务在存储中占用的总字节数上限（插件存储总共只有 1MB，
+# 还要留给会话映射和注册记录），超出时删除最早写入的任务
+MAX_STORED_TASKS_TOTAL_BYTES = 512 * 1024
+# 非终态任务在状态不变时两次写入存储的最小间隔
+TASK_PERSIST_INTERVAL_SECONDS = 1
+# 两次清理过期任务的最小间隔
+TASK_GC_INTERVAL_SECONDS = 5 * 60
+
+TERMINAL_TASK_STATES = frozenset({
+    TaskState.completed,
+    TaskState.canceled,
+    TaskState.failed,
+    TaskState.rejected,
+})
+
+
+class _CachedTask:
+    """内存 LRU 中的任务及其持久化状态"""
+
+    __slots__ = ('task', 'expires_at', 'persisted_state', 'persisted_at')
+
+    def __init__(self, task: Task, expires_at: float):
+        self.task = task
+        self.expires_at = expires_at
+        self.persisted_state: Optional[TaskState] = None
+        self.persisted_at = 0.0
+
+
+class DifyStorageTaskStore(TaskStore):
+    """
+    Dify Storage TaskStore
+
+    任务先写入内存 LRU，再写入 Dify Plugin Storage，因此同一进程内的
+    tasks/get、tasks/cancel 直接命中内存，其他进程或重启后从存储读取。
+
+    存储需要当前请求的 Dify Plugin Session，从 ServerCallContext.state
+    中的 SessionScope 获取；没有 Session 或请求已结束时只使用内存。
+    存储没有遍历接口，每次写入后把已写入或删除的任务 ID、过期时间及
+    大小合并到索引键中，定期清理时删除过期的任务；本进程写入的任务超出
+    MAX_STORED_TASKS_TOTAL_BYTES 时立即删除最早写入的，清理时再按
+    索引对所有进程写入的任务执行同样的上限。
+    """
+
+    KEY_PREFIX = "task"
+    INDEX_KEY_PREFIX = "taskindex"
+
+    def __init__(self, app_id: str, max_cached_tasks: int = MAX_CACHED_TASKS):
+        """
+        初始化 TaskStore
+
+        Args:
+            app_id: Dify App ID，用于隔离不同 App 的任务
+            max_cached_tasks: 内存 LRU 中保留的任务数量上限
+        """
+        self.app_id = app_id
+        self.max_cached_tasks = max_cached_tasks
+        self._tasks: OrderedDict[str, _CachedTask] = OrderedDict()
+        # 本进程写入或删除、尚未合并到存储索引的任务，
+        # task_id -> [过期时间, 字节数]，已删除的任务为 None
+        self._pending_index: dict[str, Optional[list]] = {}
+        # 本进程写入存储的任务，按写入顺序，task_id -> (过期时间, 字节数)
+        self._stored: OrderedDict[str, tuple[float, int]] = OrderedDict()
+        self._stored_bytes = 0
+        self._lock = threading.Lock()
+        self._index_updating = False
+        self._last_gc = time.time()
+
+    def _build_key(self, task_id: str) -> str:
+        """构建存储键 - 格式: task:{app_id}:{task_id}"""
+        return f"{self.KEY_PREFIX}:{self.app_id}:{task_id}"
+
+    def _build_index_key(self) -> str:
+        """构建索引键 - 格式: taskindex:{app_id}"""
+        return f"{self.INDEX_KEY_PREFIX}:{self.app_id}"
+
+    @staticmethod
+    def _get_storage(context: Optional[ServerCallContext]):
+        """取出当前请求的存储，并登记当前任务，请求在其完成后才结束"""
+        scope = get_session_scope(context)
+        session = scope.session if scope is not None else None
+        if session is None:
+            return None
+        scope.track()
+        return session.storage
+
+    def _cache(self, task: Task, expires_at: float) -> _CachedTask:
+        with self._lock:
+            entry = self._tasks.get(task.id)
+            if entry is None:
+                entry = _CachedTask(task, expires_at)
+                self._tasks[task.id] = entry
+            else:
+                entry.task = task
+                entry.expires_at = expires_at
+                self._tasks.move_to_end(task.id)
+            while len(self._tasks) > self.max_cached_tasks:
+                self._tasks.popitem(last=False)
+            return entry
+
+    def _needs_persist(self, entry: _CachedTask, now: float) -> bool:
+        """状态变化或到达终态时立即写入，其余更新（如追加产物）按间隔合并"""
+        state = entry.task.status.state
+        if state != entry.persisted_state or state in TERMINAL_TASK_STATES:
+            return True
+        return now - entry.persisted_at >= TASK_PERSIST_INTERVAL_SECONDS
+
+    def _serialize(self, task: Task, expires_at: float) -> Optional[bytes]:
+        """序列化任务，超过大小上限时去掉 history，仍然超出则返回 None"""
+        for candidate in (task, task.model_copy(update={'history': None})):
+            value_bytes = json.dumps({
+                'expires_at': expires_at,
+                'task': candidate.model_dump(mode='json', exclude_none=True),
+            }, ensure_ascii=False).encode('utf-8')
+            if len(value_bytes) <= MAX_STORED_TASK_BYTES:
+                return value_bytes
+        return None
+
+    def _forget_stored(self, task_id: str) -> None:
+        """从本进程的写入记录中移除任务，调用方需持有锁"""
+        stored = self._stored.pop(task_id, None)
+        if stored is not None:
+            self._stored_bytes -= stored[1]
+        self._pending_index[task_id] = None
+
+    def _write(self, storage, task: Task, expires_at: float) -> None:
+        value_bytes = self._serialize(task, expires_at)
+        if value_bytes is None:
+            logger.warning(f"Task {task.id} exceeds {MAX_STORED_TASK_BYTES} bytes, kept in memory only")
+            return
+        storage.set(self._build_key(task.id), value_bytes)
+        size = len(value_bytes)
+        evicted = []
+        with self._lock:
+            self._forget_stored(task.id)
+            self._stored[task.id] = (expires_at, size)
+            self._stored_bytes += size
+            self._pending_index[task.id] = [expires_at, size]
+            while self._stored_bytes > MAX_STORED_TASKS_TOTAL_BYTES and len(self._stored) > 1:
+                evicted_id = next(iter(self._stored))
+                self._forget_stored(evicted_id)
+                evicted.append(evicted_id)
+        for evicted_id in evicted:
+            storage.delete(self._build_key(evicted_id))
+        if evicted:
+            logger.info(f"Removed {len(evicted)} tasks of app {self.app_id} from storage, "
+                        f"over the {MAX_STORED_TASKS_TOTAL_BYTES} bytes budget")
+
+    def _read(self, storage, task_id: str) -> Optional[tuple[Task, float]]:
+        try:
+            value_bytes = storage.get(self._build_key(task_id))
+        except Exception as e:
+            # 键不存在时 get() 会抛出异常
+            logger.debug(f"Task {task_id} not found in storage: {e}")
+            return None
+        if not value_bytes:
+            return None
+        data = json.loads(value_bytes.decode('utf-8'))
+        expires_at = data.get('expires_at', 0)
+        if expires_at <= time.time():
+            storage.delete(self._build_key(task_id))
+            return None
+        return Task.model_validate(data.get('task')), expires_at
+
+    async def save(self, task: Task, context: Optional[ServerCallContext] = None) -> None:
+        """保存任务到内存 LRU，并按需写入存储"""
+        now = time.time()
+        ttl = TERMINAL_TASK_TTL_SECONDS if task.status.state in TERMINAL_TASK_STATES else TASK_TTL_SECONDS
+        expires_at = now + ttl
+        entry = self._cache(task, expires_at)
+        storage = self._get_storage(context)
+        if storage is None or not self._needs_persist(entry, now):
+            return
+
+        entry.persisted_state = task.status.state
+        entry.persisted_at = now
+        try:
+            await asyncio.to_thread(self._write, storage, task, expires_at)
+        except Exception as e:
+            entry.persisted_state = None
+            logger.warning(f"Failed to persist task {task.id}: {e}")
+
+        collect = self._start_index_update(now)
+        if collect is not None:
+            await asyncio.to_thread(self._update_index, storage, collect)
+
+    async def get(self, task_id: str, context: Optional[ServerCallContext] = None) -> Optional[Task]:
+        """获取任务，优先从内存 LRU 读取"""
+        now = time.time()
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._tasks.move_to_end(task_id)
+                    return entry.task
+                del self._tasks[task_id]
+
+        storage = self._get_storage(context)
+        if storage is None:
+            return None
+        try:
+            result = await asyncio.to_thread(self._read, storage, task_id)
+        except Exception as e:
+            logger.warning(f"Failed to load task {task_id}: {e}")
+            return None
+        if result is None:
+            return None
+
+        task, expires_at = result
+        entry = self._cache(task, expires_at)
+        entry.persisted_state = task.status.state
+        entry.persisted_at = now
+        return task
+
+    async def delete(self, task_id: str, context: Optional[ServerCallContext] = None) -> None:
+        """从内存 LRU 和存储中删除任务"""
+        with self._lock:
+            self._tasks.pop(task_id, None)
+            self._forget_stored(task_id)
+        storage = self._get_storage(context)
+        if storage is None:
+            return
+        try:
+            await asyncio.to_thread(storage.delete, self._build_key(task_id))
+        except Exception as e:
+            logger.warning(f"Failed to delete task {task_id}: {e}")
+            return
+        collect = self._start_index_update(time.time())
+        if collect is not None:
+            await asyncio.to_thread(self._update_index, storage, collect)
+
+    def _start_index_update(self, now: float) -> Optional[bool]:
+        """
+        开始更新存储索引，返回本次是否同时清理过期任务
+
+        没有待合并的任务且未到清理间隔，或已有更新正在进行时返回 None，
+        待合并的任务留给下一次写入。更新在写入任务的请求中进行，
+        Session 只在请求期间有效。
+        """
+        with self._lock:
+            if self._index_updating:
+                return None
+            collect = now - self._last_gc >= TASK_GC_INTERVAL_SECONDS
+            if not collect and not self._pending_index:
+                return None
+            self._index_updating = True
+            if collect:
+                self._last_gc = now
+            return collect
+
+    def _update_index(self, storage, collect: bool) -> None:
+        """
+        合并本进程写入或删除的任务到存储索引；collect 为 True 时删除索引中
+        已过期的任务，总大小仍超出 MAX_STORED_TASKS_TOTAL_BYTES 时按过期时间
+        从早到晚删除
+
+        索引的读改写不是原子的，多个进程同时更新时可能丢失个别条目，
+        这些任务仍会在被读取时按过期时间删除。
+        """
+        index_key = self._build_index_key()
+        with self._lock:
+            pending = self._pending_index
+            self._pending_index = {}
+        try:
+            try:
+                index = json.loads(storage.get(index_key).decode('utf-8'))
+            except Exception:
+                index = {}
+            for task_id, value in pending.items():
+                if value is None:
+                    index.pop(task_id, None)
+                else:
+                    index[task_id] = value
+
+            removed = []
+            expired_count = 0
+            if collect:
+                now = time.time()
+                removed = [task_id for task_id, (expires_at, _) in index.items() if expires_at <= now]
+                expired_count = len(removed)
+                total_bytes = sum(size for task_id, (expires_at, size) in index.items() if expires_at > now)
+                for task_id, (_, size) in sorted(index.items(), key=lambda item: item[1][0]):
+                    if total_bytes <= MAX_STORED_TASKS_TOTAL_BYTES:
+                        break
+                    if task_id not in removed:
+                        removed.append(task_id)
+                        total_bytes -= size
+                for task_id in removed:
+                    storage.delete(self._build_key(task_id))
+                    del index[task_id]
+            storage.set(index_key, json.dumps(index).encode('utf-8'))
+            with self._lock:
+                for task_id in removed:
+                    self._forget_stored(task_id)
+                    # 已从索引中删除，无需再次合并
+                    self._pending_index.pop(task_id, None)
+            if removed:
+                logger.info(f"Removed {expired_count} expired and {len(removed) - expired_count} "
+                            f"over-budget tasks of app {self.app_id}")
+        except Exception as e:
+            # 合并失败的任务留给下一次写入，期间更新过的以新值为准
+            with self._lock:
+                for task_id, value in pending.items():
+                    self._pending_index.setdefault(task_id, value)
+            logger.warning(f"Failed to update the task index: {e}")
+        finally:
+            with self._lock:
+                self._index_updating = False
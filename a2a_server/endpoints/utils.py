@@ -1,36 +1,130 @@
 import json
-import time
 import asyncio
-from typing import Optional
+import logging
+import threading
+from collections.abc import Coroutine
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
 
 from a2a.types import AgentCard
+from dify_plugin.config.logger_format import plugin_logger_handler
 from maintainer.ai.nacos_ai_maintainer_service import NacosAIMaintainerService
 from v2.nacos import ClientConfigBuilder
 
+logger = logging.getLogger(__name__)
+logger.addHandler(plugin_logger_handler)
 
-async def register_agent_card(
-		agent_card: AgentCard,
+
+# ============== 事件循环 ==============
+
+# 同步的 Dify App 调用专用线程池的大小，即同时读取回答的任务数上限
+APP_INVOKE_MAX_WORKERS = 64
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_app_invoke_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+	"""
+	获取进程级的后台事件循环，首次调用时启动其线程
+
+	A2A 应用、请求处理器和 TaskStore 都绑定在这个循环上，
+	在多次请求之间复用，后台任务在请求返回后也能继续运行。
+	"""
+	global _loop
+	with _loop_lock:
+		if _loop is None or _loop.is_closed():
+			loop = asyncio.new_event_loop()
+			threading.Thread(target=loop.run_forever, name="a2a-server-loop", daemon=True).start()
+			_loop = loop
+		return _loop
+
+
+def get_app_invoke_executor() -> ThreadPoolExecutor:
+	"""
+	获取读取 Dify App 回答的专用线程池
+
+	回答流的读取会长时间占用线程，与 TaskStore、会话映射等短小的存储操作
+	（asyncio.to_thread，使用事件循环的默认线程池）分开，互不阻塞。
+	"""
+	global _app_invoke_executor
+	with _loop_lock:
+		if _app_invoke_executor is None:
+			_app_invoke_executor = ThreadPoolExecutor(
+					max_workers=APP_INVOKE_MAX_WORKERS, thread_name_prefix="a2a-app-invoke")
+		return _app_invoke_executor
+
+
+def run_async(coro: Coroutine, timeout: Optional[float] = None) -> Any:
+	"""在后台事件循环中执行协程，并阻塞等待结果"""
+	future = asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+	try:
+		return future.result(timeout)
+	except TimeoutError:
+		future.cancel()
+		raise
+
+
+# ============== Nacos 注册 ==============
+
+_maintainer_services: dict[tuple, NacosAIMaintainerService] = {}
+_maintainer_services_lock: Optional[asyncio.Lock] = None
+
+
+async def get_nacos_ai_maintainer_service(
 		nacos_addr: str,
 		namespace_id: str,
 		username: str,
 		password: str,
 		access_key: str,
 		secret_key: str
-):
+) -> NacosAIMaintainerService:
+	"""
+	获取 Nacos AI Maintainer Service，按连接参数缓存复用
+
+	必须在 get_event_loop() 返回的后台事件循环中调用。
+	"""
+	global _maintainer_services_lock
 	if nacos_addr is None:
 		raise ValueError("when type is nacos, nacos_addr is required")
 	if ':' not in nacos_addr.split('//')[-1]:
 		nacos_addr = f"{nacos_addr}:8848"
 
-	nacos_client_config = ClientConfigBuilder().server_address(
-			nacos_addr).namespace_id(
-			namespace_id).username(
-			username).password(
-			password).access_key(
-			access_key).secret_key(
-			secret_key).build()
-	nacos_ai_maintainer_service = await NacosAIMaintainerService.create_ai_service(
-			nacos_client_config)
+	key = (nacos_addr, namespace_id, username, password, access_key, secret_key)
+	service = _maintainer_services.get(key)
+	if service is not None:
+		return service
+
+	if _maintainer_services_lock is None:
+		_maintainer_services_lock = asyncio.Lock()
+	async with _maintainer_services_lock:
+		service = _maintainer_services.get(key)
+		if service is None:
+			nacos_client_config = ClientConfigBuilder().server_address(
+					nacos_addr).namespace_id(
+					namespace_id).username(
+					username).password(
+					password).access_key(
+					access_key).secret_key(
+					secret_key).build()
+			service = await NacosAIMaintainerService.create_ai_service(
+					nacos_client_config)
+			_maintainer_services[key] = service
+		return service
+
+
+async def register_agent_card(
+		agent_card: AgentCard,
+		nacos_addr: str,
+		namespace_id: str,
+		username: str,
+		password: str,
+		access_key: str,
+		secret_key: str
+):
+	nacos_ai_maintainer_service = await get_nacos_ai_maintainer_service(
+			nacos_addr, namespace_id, username, password, access_key, secret_key)
 	await nacos_ai_maintainer_service.register_agent(
 			agent_card=agent_card,
 			namespace_id=namespace_id,
@@ -48,20 +142,8 @@ async def get_agent_card(
 		access_key: str,
 		secret_key: str
 ) -> AgentCard:
-	if nacos_addr is None:
-		raise ValueError("when type is nacos, nacos_addr is required")
-	if ':' not in nacos_addr.split('//')[-1]:
-		nacos_addr = f"{nacos_addr}:8848"
-
-	nacos_client_config = ClientConfigBuilder().server_address(
-			nacos_addr).namespace_id(
-			namespace_id).username(
-			username).password(
-			password).access_key(
-			access_key).secret_key(
-			secret_key).build()
-	nacos_ai_maintainer_service = await NacosAIMaintainerService.create_ai_service(
-			nacos_client_config)
+	nacos_ai_maintainer_service = await get_nacos_ai_maintainer_service(
+			nacos_addr, namespace_id, username, password, access_key, secret_key)
 	return await nacos_ai_maintainer_service.get_agent_card(
 			agent_name=agent_name,
 			version=version,
@@ -70,131 +152,93 @@ async def get_agent_card(
 	)
 
 
-# ============== AgentCard 缓存 ==============
+# ============== AgentCard 指纹与注册记录 ==============
+
+RECORD_KEY_PREFIX = "agentreg"
 
-CACHE_KEY_PREFIX = "agentcard"
-CACHE_TTL_SECONDS = 15  # 15 秒
+
+def canonical_agent_card_bytes(agent_card: AgentCard) -> bytes:
+	"""
+	AgentCard 的规范化 JSON：只包含 AgentCard 自身字段，键排序、无空白
+
+	内容相同的 AgentCard 总是得到相同的字节，其 SHA-256 即 AgentCard 的
+	内容指纹（由 AgentCardResponse 计算，同时用作 ETag）。
+	"""
+	data = agent_card.model_dump(
+			mode='json', exclude_none=True, include=set(AgentCard.model_fields))
+	return json.dumps(
+			data, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
 
 
-def _build_cache_key(
+def _build_record_key(
 		nacos_addr: str,
 		namespace_id: str,
-		agent_name: str,
-		version: str
+		agent_name: str
 ) -> str:
-	"""构建缓存 key: agentcard:{addr}:{namespace_id}:{name}:{version}"""
+	"""构建注册记录 key: agentreg:{addr}:{namespace_id}:{name}"""
 	safe_addr = nacos_addr.replace(':', '_').replace('/', '_')
-	return f"{CACHE_KEY_PREFIX}:{safe_addr}:{namespace_id}:{agent_name}:{version}"
+	return f"{RECORD_KEY_PREFIX}:{safe_addr}:{namespace_id}:{agent_name}"
 
 
-def get_cached_agent_card(
+def get_registration_record(
 		session,
 		nacos_addr: str,
 		namespace_id: str,
-		agent_name: str,
-		version: str,
-		username: str = '',
-		password: str = '',
-		access_key: str = '',
-		secret_key: str = ''
-) -> Optional[AgentCard]:
+		agent_name: str
+) -> Optional[dict]:
 	"""
-	从缓存获取 AgentCard，缓存过期则从 Nacos 获取并刷新缓存
+	从插件存储读取注册记录
 
 	Returns:
-		AgentCard 对象，如果缓存不存在或已过期会从 Nacos 获取
+		{'fingerprint': 已注册 AgentCard 的指纹, 'verified_at': 最近确认注册存在的时间}，
+		没有记录时返回 None
 	"""
-	key = _build_cache_key(nacos_addr, namespace_id, agent_name, version)
-
+	key = _build_record_key(nacos_addr, namespace_id, agent_name)
 	try:
 		value_bytes = session.storage.get(key)
 		if value_bytes:
-			cache_data = json.loads(value_bytes.decode('utf-8'))
-			cached_time = cache_data.get('cached_time', 0)
-
-			# 缓存未过期，直接返回
-			if time.time() - cached_time <= CACHE_TTL_SECONDS:
-				agent_card = AgentCard.model_validate(cache_data.get('agent_card'))
-				print(f"[AgentCardCache] Cache hit: {agent_name}")
-				return agent_card
-			else:
-				print(f"[AgentCardCache] Cache expired: {agent_name}")
-		else:
-			print(f"[AgentCardCache] Cache miss: {agent_name}")
-
-		# 缓存不存在或已过期，从 Nacos 获取
-		print(f"[AgentCardCache] Fetching from Nacos: {agent_name}")
-		agent_card = asyncio.run(get_agent_card(
-			agent_name=agent_name,
-			version=version,
-			nacos_addr=nacos_addr,
-			namespace_id=namespace_id,
-			username=username,
-			password=password,
-			access_key=access_key,
-			secret_key=secret_key
-		))
-
-		# 更新缓存
-		if agent_card:
-			set_cached_agent_card(session, nacos_addr, namespace_id, agent_card)
-			print(f"[AgentCardCache] Refreshed cache from Nacos: {agent_name}")
-
-		return agent_card
-
+			return json.loads(value_bytes.decode('utf-8'))
 	except Exception as e:
-		print(f"[AgentCardCache] Error getting agent card: {e}")
-		return None
+		# 键不存在时 get() 会抛出异常
+		logger.debug(f"No registration record for {agent_name}: {e}")
+	return None
 
 
-def set_cached_agent_card(
+def set_registration_record(
 		session,
 		nacos_addr: str,
 		namespace_id: str,
-		agent_card: AgentCard
+		agent_name: str,
+		fingerprint: str,
+		verified_at: float
 ) -> bool:
-	"""将 AgentCard 存入缓存"""
-	key = _build_cache_key(nacos_addr, namespace_id, agent_card.name,
-						   agent_card.version)
-
+	"""将注册记录写入插件存储"""
+	key = _build_record_key(nacos_addr, namespace_id, agent_name)
 	try:
-		cache_data = {
-			'cached_time': time.time(),
-			'agent_card': agent_card.model_dump(mode='json', exclude_none=True)
-		}
-		value_bytes = json.dumps(cache_data, ensure_ascii=False).encode('utf-8')
+		value_bytes = json.dumps({
+			'fingerprint': fingerprint,
+			'verified_at': verified_at,
+		}).encode('utf-8')
 		session.storage.set(key, value_bytes)
-		print(f"[AgentCardCache] Cached: {agent_card.name}")
 		return True
 	except Exception as e:
-		print(f"[AgentCardCache] Error writing cache: {e}")
+		logger.warning(f"Error writing registration record: {e}")
 		return False
 
 
-def needs_registration(current_card: AgentCard,
-		cached_card: Optional[AgentCard]) -> bool:
+def needs_registration(current_fingerprint: str,
+		registered_fingerprint: Optional[str]) -> bool:
 	"""
 	判断是否需要注册/更新 AgentCard
 
-	比较 name、description、url 是否一致
+	比较 AgentCard 的完整内容指纹，任何字段变化都会重新注册
 	"""
-	if cached_card is None:
-		print("[AgentCardCache] No cached card, registration needed")
-		return True
-
-	if current_card.name != cached_card.name:
-		print(
-			f"[AgentCardCache] Name changed: {cached_card.name} -> {current_card.name}")
-		return True
-
-	if current_card.description != cached_card.description:
-		print("[AgentCardCache] Description changed")
+	if registered_fingerprint is None:
+		logger.info("No registration record, registration needed")
 		return True
 
-	if current_card.url != cached_card.url:
-		print(
-			f"[AgentCardCache] URL changed: {cached_card.url} -> {current_card.url}")
+	if current_fingerprint != registered_fingerprint:
+		logger.info("Agent card changed, registration needed")
 		return True
 
-	print("[AgentCardCache] No changes detected, skip registration")
 	return False
@@ -1,14 +1,30 @@
+import logging
 from typing import Any
 
 from dify_plugin import ToolProvider
+from dify_plugin.config.logger_format import plugin_logger_handler
 from dify_plugin.errors.tool import ToolProviderCredentialValidationError
 
+from tools.utils import run_async, warm_up_config_service
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.addHandler(plugin_logger_handler)
+
+# Upper bound for login plus the probe read.
+VALIDATION_TIMEOUT_SECONDS = 30
+
 
 class NacosProvider(ToolProvider):
     def _validate_credentials(self, credentials: dict[str, Any]) -> None:
+        if not credentials.get("nacos_addr"):
+            raise ToolProviderCredentialValidationError("nacos_addr is required")
+
         try:
-            """
-            IMPLEMENT YOUR VALIDATION HERE
-            """
+            elapsed_ms = run_async(warm_up_config_service(credentials), timeout=VALIDATION_TIMEOUT_SECONDS)
+            logger.info(f"Nacos credentials validated against {credentials.get('nacos_addr')} in {elapsed_ms:.1f} ms")
+        except TimeoutError:
+            raise ToolProviderCredentialValidationError(
+                f"Timed out connecting to Nacos at {credentials.get('nacos_addr')}")
         except Exception as e:
             raise ToolProviderCredentialValidationError(str(e))
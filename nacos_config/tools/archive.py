@@ -0,0 +1,111 @@
+import io
+import json
+import zipfile
+from collections.abc import Iterator
+from typing import Any
+
+from tools.utils import MAX_CONFIG_BYTES
+
+MANIFEST_NAME = "manifest.json"
+ARCHIVE_FORMAT_VERSION = 1
+# Upper bound for the compressed archive, both when exporting and importing.
+MAX_ARCHIVE_BYTES = 64 * 1024 * 1024
+# Upper bounds for the decompressed manifest and for all decompressed configs
+# of one archive, so a small archive cannot inflate without limit.
+MAX_MANIFEST_BYTES = 8 * 1024 * 1024
+MAX_EXTRACTED_BYTES = 256 * 1024 * 1024
+
+
+class ConfigArchiveWriter:
+    """
+    Incrementally writes configs into an in-memory zip archive.
+
+    Each config is stored as {group}/{data_id}, a manifest.json with the
+    metadata of every entry is appended on close.
+    """
+
+    def __init__(self, namespace_id: str):
+        self.namespace_id = namespace_id
+        self.entries: list[dict[str, Any]] = []
+        self.raw_bytes = 0
+        self._buffer = io.BytesIO()
+        self._zip = zipfile.ZipFile(self._buffer, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6)
+
+    @property
+    def size(self) -> int:
+        return self._buffer.tell()
+
+    def add(self, item: dict[str, Any], content: str) -> None:
+        data_id = item.get("dataId")
+        group = item.get("group")
+        path = f"{group}/{data_id}"
+        data = content.encode("utf-8")
+        self._zip.writestr(path, data)
+        self.raw_bytes += len(data)
+        self.entries.append({
+            "data_id": data_id,
+            "group": group,
+            "type": item.get("type") or "",
+            "app_name": item.get("appName") or "",
+            "md5": item.get("md5"),
+            "path": path,
+        })
+        if self.size > MAX_ARCHIVE_BYTES:
+            raise ValueError(f"export archive exceeds the {MAX_ARCHIVE_BYTES} bytes limit")
+
+    def close(self) -> bytes:
+        self._zip.writestr(MANIFEST_NAME, json.dumps({
+            "version": ARCHIVE_FORMAT_VERSION,
+            "namespace_id": self.namespace_id,
+            "configs": self.entries,
+        }, ensure_ascii=False, indent=2))
+        self._zip.close()
+        return self._buffer.getvalue()
+
+
+def iter_archive(data: bytes) -> Iterator[tuple[dict[str, Any], str]]:
+    """
+    Yield (manifest entry, content) pairs from an exported archive.
+
+    Entries are decompressed one at a time as the iterator advances. Sizes
+    are checked against the zip directory before anything is inflated,
+    zipfile never returns more than the declared size of an entry.
+
+    Raises:
+        ValueError: If the archive is too large or malformed, an entry exceeds
+            MAX_CONFIG_BYTES or all entries together exceed MAX_EXTRACTED_BYTES
+    """
+    if len(data) > MAX_ARCHIVE_BYTES:
+        raise ValueError(f"archive exceeds the {MAX_ARCHIVE_BYTES} bytes limit")
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"not a valid config archive: {e}")
+
+    with archive:
+        try:
+            manifest_info = archive.getinfo(MANIFEST_NAME)
+        except KeyError:
+            raise ValueError(f"{MANIFEST_NAME} is missing from the archive")
+        if manifest_info.file_size > MAX_MANIFEST_BYTES:
+            raise ValueError(f"{MANIFEST_NAME} exceeds the {MAX_MANIFEST_BYTES} bytes limit")
+        manifest = json.loads(archive.read(manifest_info))
+        if manifest.get("version") != ARCHIVE_FORMAT_VERSION:
+            raise ValueError(f"unsupported archive version: {manifest.get('version')}")
+
+        entries = []
+        total = 0
+        for entry in manifest.get("configs") or []:
+            try:
+                info = archive.getinfo(entry["path"])
+            except KeyError:
+                raise ValueError(f"config {entry['path']} is missing from the archive")
+            if info.file_size > MAX_CONFIG_BYTES:
+                raise ValueError(f"config {entry['path']} exceeds the {MAX_CONFIG_BYTES} bytes limit")
+            total += info.file_size
+            if total > MAX_EXTRACTED_BYTES:
+                raise ValueError(f"archive expands to more than the {MAX_EXTRACTED_BYTES} bytes limit")
+            entries.append((entry, info))
+
+        for entry, info in entries:
+            yield entry, archive.read(info).decode("utf-8")
@@ -0,0 +1,141 @@
+import difflib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from nacos import NacosClient
+
+HISTORY_PATH = "/nacos/v1/cs/history"
+# The v1 client has no public history API, requests go through its internal
+# request helper, which adds auth and fails over between servers. The helper
+# is private, so nacos-sdk-python is pinned to an exact version in
+# requirements.txt and the helper is only used from _request_history.
+_sync_request = getattr(NacosClient, "_do_sync_req", None)
+MAX_PAGE_SIZE = 100
+# Historical revisions never change, so they are cached until evicted by size.
+REVISION_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+
+class RevisionCache:
+    """
+    Process-level LRU of historical config contents, bounded by the total
+    UTF-8 encoded size of the contents.
+    """
+
+    def __init__(self, max_bytes: int = REVISION_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # key -> (revision, encoded content size)
+        self._entries: OrderedDict[tuple, tuple[dict, int]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: tuple, revision: dict) -> None:
+        size = len((revision.get("content") or "").encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._entries[key] = (revision, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+
+revision_cache = RevisionCache()
+
+
+def _request_history(client: NacosClient, params: dict[str, Any]) -> dict:
+    if _sync_request is None:
+        raise RuntimeError("the installed nacos-sdk-python does not support config history, "
+                           "install the version pinned in requirements.txt")
+    if client.namespace:
+        params["tenant"] = client.namespace
+    resp = _sync_request(client, HISTORY_PATH, params=params, timeout=client.default_timeout)
+    return json.loads(resp.read().decode("UTF-8"))
+
+
+def list_history(client: NacosClient, data_id: str, group: str, page_no: int, page_size: int) -> dict:
+    """
+    List one page of history entries for a config, newest first.
+
+    Contents are left out, entries carry the nid used to fetch a revision.
+    """
+    page = _request_history(client, {
+        "search": "accurate",
+        "dataId": data_id,
+        "group": group,
+        "pageNo": max(page_no, 1),
+        "pageSize": min(max(page_size, 1), MAX_PAGE_SIZE),
+    })
+    items = [{
+        "nid": str(item.get("id")),
+        "md5": item.get("md5"),
+        "op_type": (item.get("opType") or "").strip(),
+        "src_user": item.get("srcUser"),
+        "src_ip": item.get("srcIp"),
+        "created_time": item.get("createdTime"),
+        "last_modified_time": item.get("lastModifiedTime"),
+    } for item in page.get("pageItems") or []]
+    return {
+        "total_count": page.get("totalCount"),
+        "page_number": page.get("pageNumber"),
+        "pages_available": page.get("pagesAvailable"),
+        "items": items,
+    }
+
+
+def get_revision(client: NacosClient, data_id: str, group: str, nid: str) -> dict:
+    """
+    Fetch a historical revision by nid, served from the revision cache when possible.
+    """
+    key = (tuple(client.server_list), client.namespace, group, data_id, nid)
+    revision = revision_cache.get(key)
+    if revision is not None:
+        return revision
+
+    detail = _request_history(client, {"nid": nid, "dataId": data_id, "group": group})
+    if not detail or detail.get("dataId") not in (None, data_id):
+        raise ValueError(f"history revision {nid} not found for {group}/{data_id}")
+    revision = {
+        "nid": str(detail.get("id", nid)),
+        "md5": detail.get("md5"),
+        "op_type": (detail.get("opType") or "").strip(),
+        "last_modified_time": detail.get("lastModifiedTime"),
+        "content": detail.get("content") or "",
+    }
+    revision_cache.put(key, revision)
+    return revision
+
+
+def unified_diff(base: str, target: str, base_label: str, target_label: str, context_lines: int) -> dict:
+    """
+    Compute a unified diff and summary counts between two config bodies.
+    """
+    lines = list(difflib.unified_diff(
+        base.splitlines(keepends=True),
+        target.splitlines(keepends=True),
+        fromfile=base_label,
+        tofile=target_label,
+        n=max(context_lines, 0),
+    ))
+    # Skip the ---/+++ file headers
+    added = sum(1 for line in lines[2:] if line.startswith("+"))
+    removed = sum(1 for line in lines[2:] if line.startswith("-"))
+    return {
+        "identical": not lines,
+        "added_lines": added,
+        "removed_lines": removed,
+        "diff": "".join(line if line.endswith("\n") else line + "\n" for line in lines),
+    }
@@ -0,0 +1,87 @@
+import asyncio
+import time
+from collections.abc import Generator
+from typing import Any
+
+from dify_plugin import Tool
+from dify_plugin.entities.tool import ToolInvokeMessage
+from v2.nacos import ConfigParam
+
+from tools.archive import ConfigArchiveWriter
+from tools.utils import get_config_service, get_legacy_client, run_async
+
+MAX_PAGE_SIZE = 500
+MAX_CONCURRENCY = 32
+
+
+class NacosTool(Tool):
+    def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage]:
+        # Extract parameters
+        namespace_id = str(tool_parameters.get("namespace_id"))
+        group_name = tool_parameters.get("group_name") or ""
+        page_size = min(max(int(tool_parameters.get("page_size") or 100), 1), MAX_PAGE_SIZE)
+        concurrency = min(max(int(tool_parameters.get("concurrency") or 8), 1), MAX_CONCURRENCY)
+
+        async def export_namespace() -> ConfigArchiveWriter:
+            client = get_legacy_client(self.runtime.credentials, namespace_id)
+            config_service = await get_config_service(self.runtime.credentials, namespace_id)
+            semaphore = asyncio.Semaphore(concurrency)
+            writer = ConfigArchiveWriter(namespace_id)
+
+            def list_page(page_no: int):
+                return asyncio.to_thread(client.get_configs, no_snapshot=True, group=group_name,
+                                         page_no=page_no, page_size=page_size)
+
+            async def fetch(item: dict[str, Any]) -> str:
+                # Search pages usually carry the content already
+                if item.get("content") is not None:
+                    return item["content"]
+                async with semaphore:
+                    return await config_service.get_config(
+                        ConfigParam(data_id=item["dataId"], group=item["group"]))
+
+            page_no = 1
+            next_page = asyncio.ensure_future(list_page(page_no))
+            while next_page is not None:
+                page = await next_page or {}
+                items = page.get("pageItems") or []
+                # List the following page while this one's contents are fetched
+                has_more = bool(items) and page_no < (page.get("pagesAvailable") or 0)
+                next_page = asyncio.ensure_future(list_page(page_no + 1)) if has_more else None
+                page_no += 1
+
+                try:
+                    contents = await asyncio.gather(*(fetch(item) for item in items))
+                    for item, content in zip(items, contents):
+                        writer.add(item, content or "")
+                except BaseException:
+                    if next_page is not None:
+                        next_page.cancel()
+                    raise
+            return writer
+
+        try:
+            start = time.perf_counter()
+            writer = run_async(export_namespace())
+            archive = writer.close()
+            elapsed = time.perf_counter() - start
+            count = len(writer.entries)
+            yield self.create_blob_message(archive, meta={
+                "mime_type": "application/zip",
+                "filename": f"nacos-{namespace_id or 'public'}-configs.zip",
+            })
+            yield self.create_json_message({
+                "success": True,
+                "namespace_id": namespace_id,
+                "config_count": count,
+                "raw_bytes": writer.raw_bytes,
+                "archive_bytes": len(archive),
+                "elapsed_seconds": round(elapsed, 3),
+                "configs_per_second": round(count / elapsed, 1) if elapsed > 0 else None,
+            })
+
+        except Exception as e:
+            yield self.create_json_message({
+                "success": False,
+                "error": str(e)
+            })
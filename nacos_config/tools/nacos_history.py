@@ -0,0 +1,70 @@
+from collections.abc import Generator
+from typing import Any
+
+from dify_plugin import Tool
+from dify_plugin.entities.tool import ToolInvokeMessage
+from v2.nacos import ConfigParam
+
+from tools.history import get_revision, list_history, unified_diff
+from tools.utils import MAX_INLINE_BYTES, get_config_service, get_legacy_client, run_async
+
+CURRENT_REVISION = "current"
+
+
+class NacosTool(Tool):
+    def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage]:
+        # Extract parameters
+        namespace_id = str(tool_parameters.get("namespace_id"))
+        data_id = str(tool_parameters.get("data_id"))
+        group_name = str(tool_parameters.get("group_name"))
+        action = tool_parameters.get("action") or "list"
+        context_lines = tool_parameters.get("context_lines")
+        context_lines = 3 if context_lines is None else int(context_lines)
+
+        async def read_current() -> str:
+            config_service = await get_config_service(self.runtime.credentials, namespace_id)
+            return await config_service.get_config(ConfigParam(data_id=data_id, group=group_name))
+
+        def load(nid: str) -> str:
+            if not nid or nid == CURRENT_REVISION:
+                return run_async(read_current()) or ""
+            return get_revision(client, data_id, group_name, nid)["content"]
+
+        try:
+            client = get_legacy_client(self.runtime.credentials, namespace_id)
+
+            if action == "list":
+                result = list_history(client, data_id, group_name,
+                                      int(tool_parameters.get("page_no") or 1),
+                                      int(tool_parameters.get("page_size") or 20))
+            elif action == "get":
+                nid = str(tool_parameters.get("nid") or "")
+                if not nid:
+                    raise ValueError("nid is required for action 'get'")
+                result = dict(get_revision(client, data_id, group_name, nid))
+                if len((result["content"] or "").encode("utf-8")) > MAX_INLINE_BYTES:
+                    raise ValueError(f"revision {nid} is larger than {MAX_INLINE_BYTES} bytes, use action 'diff' instead")
+            elif action == "diff":
+                base_nid = str(tool_parameters.get("nid") or "")
+                if not base_nid:
+                    raise ValueError("nid is required for action 'diff'")
+                target_nid = str(tool_parameters.get("target_nid") or CURRENT_REVISION)
+                result = unified_diff(load(base_nid), load(target_nid),
+                                      f"{data_id}@{base_nid}", f"{data_id}@{target_nid}",
+                                      context_lines)
+                if len(result["diff"].encode("utf-8")) > MAX_INLINE_BYTES:
+                    raise ValueError(f"diff is larger than {MAX_INLINE_BYTES} bytes, "
+                                     f"reduce context_lines or compare closer revisions")
+            else:
+                raise ValueError(f"unsupported action: {action}")
+
+            yield self.create_json_message({
+                "success": True,
+                **result
+            })
+
+        except Exception as e:
+            yield self.create_json_message({
+                "success": False,
+                "error": str(e)
+            })
@@ -0,0 +1,87 @@
+import asyncio
+import time
+from collections.abc import Generator, Iterator
+from typing import Any
+
+from dify_plugin import Tool
+from dify_plugin.entities.tool import ToolInvokeMessage
+from v2.nacos import ConfigParam
+
+from tools.archive import iter_archive
+from tools.utils import get_config_service, run_async
+
+MAX_BATCH_SIZE = 100
+# A batch is also closed once its contents reach this size, so at most about
+# one batch of decompressed configs is held in memory at a time.
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+
+
+class NacosTool(Tool):
+    def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage]:
+        # Extract parameters
+        namespace_id = str(tool_parameters.get("namespace_id"))
+        archive_file = tool_parameters.get("archive")
+        batch_size = min(max(int(tool_parameters.get("batch_size") or 20), 1), MAX_BATCH_SIZE)
+        overwrite = tool_parameters.get("overwrite")
+        overwrite = True if overwrite is None else bool(overwrite)
+
+        def iter_batches(entries: Iterator[tuple[dict[str, Any], str]]) -> Iterator[list[tuple[dict[str, Any], str]]]:
+            batch, batch_bytes = [], 0
+            for entry, content in entries:
+                batch.append((entry, content))
+                batch_bytes += len(content)
+                if len(batch) >= batch_size or batch_bytes >= MAX_BATCH_BYTES:
+                    yield batch
+                    batch, batch_bytes = [], 0
+            if batch:
+                yield batch
+
+        async def import_batch(batch: list[tuple[dict[str, Any], str]], result: dict[str, Any]) -> None:
+            config_service = await get_config_service(self.runtime.credentials, namespace_id)
+
+            async def publish(entry: dict[str, Any], content: str) -> bool:
+                if not overwrite and await config_service.get_config(
+                        ConfigParam(data_id=entry["data_id"], group=entry["group"])):
+                    return False
+                if not await config_service.publish_config(ConfigParam(
+                        data_id=entry["data_id"], group=entry["group"], content=content,
+                        type=entry.get("type") or "", app_name=entry.get("app_name") or "")):
+                    raise ValueError("publish rejected by server")
+                return True
+
+            outcomes = await asyncio.gather(*(publish(entry, content) for entry, content in batch),
+                                            return_exceptions=True)
+            for (entry, _), outcome in zip(batch, outcomes):
+                if isinstance(outcome, BaseException):
+                    result["failed"].append({"data_id": entry["data_id"], "group": entry["group"],
+                                             "error": str(outcome)})
+                elif outcome:
+                    result["published"] += 1
+                else:
+                    result["skipped"] += 1
+
+        try:
+            if archive_file is None:
+                raise ValueError("archive is required")
+            start = time.perf_counter()
+            # Configs are inflated batch by batch while importing, not all up front
+            result = {"published": 0, "skipped": 0, "failed": []}
+            config_count = 0
+            for batch in iter_batches(iter_archive(archive_file.blob)):
+                config_count += len(batch)
+                run_async(import_batch(batch, result))
+            elapsed = time.perf_counter() - start
+            yield self.create_json_message({
+                "success": not result["failed"],
+                "namespace_id": namespace_id,
+                "config_count": config_count,
+                **result,
+                "elapsed_seconds": round(elapsed, 3),
+                "configs_per_second": round(config_count / elapsed, 1) if elapsed > 0 else None,
+            })
+
+        except Exception as e:
+            yield self.create_json_message({
+                "success": False,
+                "error": str(e)
+            })
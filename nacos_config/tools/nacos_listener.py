@@ -0,0 +1,56 @@
+import asyncio
+from collections.abc import Generator
+from typing import Any
+
+from dify_plugin import Tool
+from dify_plugin.entities.tool import ToolInvokeMessage
+from v2.nacos import ConfigParam
+
+from tools.utils import MAX_INLINE_BYTES, get_config_service, run_async
+
+# Keep well below the plugin MAX_REQUEST_TIMEOUT of 120 seconds.
+MAX_WAIT_SECONDS = 100
+
+
+class NacosTool(Tool):
+    def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage]:
+        # Extract parameters
+        namespace_id = str(tool_parameters.get("namespace_id"))
+        data_id = str(tool_parameters.get("data_id"))
+        group_name = str(tool_parameters.get("group_name"))
+        timeout = min(max(int(tool_parameters.get("timeout_seconds") or 30), 1), MAX_WAIT_SECONDS)
+
+        async def wait_for_change() -> tuple[bool, str | None]:
+            config_service = await get_config_service(self.runtime.credentials, namespace_id)
+            current = await config_service.get_config(ConfigParam(data_id=data_id, group=group_name))
+            changed = asyncio.get_running_loop().create_future()
+
+            async def listener(tenant: str, group: str, listened_data_id: str, content: str) -> None:
+                if content != current and not changed.done():
+                    changed.set_result(content)
+
+            await config_service.add_listener(data_id, group_name, listener)
+            try:
+                return True, await asyncio.wait_for(changed, timeout)
+            except asyncio.TimeoutError:
+                return False, current
+            finally:
+                await config_service.remove_listener(data_id, group_name, listener)
+
+        try:
+            changed, config = run_async(wait_for_change())
+            size = len(config.encode("utf-8")) if config else 0
+            result = {
+                "success": True,
+                "changed": changed,
+                "total_bytes": size,
+            }
+            if size <= MAX_INLINE_BYTES:
+                result["config"] = config
+            yield self.create_json_message(result)
+
+        except Exception as e:
+            yield self.create_json_message({
+                "success": False,
+                "error": str(e)
+            })
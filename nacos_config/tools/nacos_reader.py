@@ -3,23 +3,75 @@ from typing import Any
 
 from dify_plugin import Tool
 from dify_plugin.entities.tool import ToolInvokeMessage
-from nacos import NacosClient
+from v2.nacos import ConfigParam
+
+from tools.utils import (
+    DEFAULT_RANGE_BYTES,
+    MAX_INLINE_BYTES,
+    compress_blob,
+    get_config_service,
+    read_range,
+    run_async,
+)
 
 
 class NacosTool(Tool):
     def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage]:
         # Extract parameters
-        nacos_addr = self.runtime.credentials.get("nacos_addr")
-        username = self.runtime.credentials.get("nacos_username")
-        password = self.runtime.credentials.get("nacos_password")
-        access_key = self.runtime.credentials.get("nacos_accessKey")
-        secret_key = self.runtime.credentials.get("nacos_secretKey")
         namespace_id = str(tool_parameters.get("namespace_id"))
         data_id = str(tool_parameters.get("data_id"))
         group_name = str(tool_parameters.get("group_name"))
-        client = NacosClient(nacos_addr, namespace=namespace_id, username=username, password=password, ak=access_key, sk=secret_key)
+        output_mode = tool_parameters.get("output_mode") or "json"
+        offset = int(tool_parameters.get("offset") or 0)
+        max_bytes = int(tool_parameters.get("max_bytes") or DEFAULT_RANGE_BYTES)
+
+        async def read_config() -> str:
+            config_service = await get_config_service(self.runtime.credentials, namespace_id)
+            return await config_service.get_config(ConfigParam(data_id=data_id, group=group_name))
+
         try:
-            config = client.get_config(data_id=data_id, group=group_name)
+            config = run_async(read_config())
+            if not config:
+                yield self.create_json_message({
+                    "success": True,
+                    "config": None
+                })
+                return
+
+            if output_mode == "blob":
+                content = config.encode("utf-8")
+                del config
+                compress = bool(tool_parameters.get("compress"))
+                blob = compress_blob(content) if compress else content
+                yield self.create_blob_message(blob, meta={
+                    "mime_type": "application/gzip" if compress else "text/plain",
+                    "filename": f"{data_id}.gz" if compress else data_id,
+                    "size": len(content),
+                })
+                return
+
+            if output_mode == "range":
+                # Nacos has no ranged read, the whole config is fetched and
+                # encoded on every call, only the returned message is bounded
+                content = config.encode("utf-8")
+                del config
+                yield self.create_json_message({
+                    "success": True,
+                    **read_range(content, offset, max_bytes)
+                })
+                return
+
+            # A UTF-8 character is at most 4 bytes, so short configs skip the encode
+            size = len(config) if len(config) * 4 <= MAX_INLINE_BYTES else len(config.encode("utf-8"))
+            if size > MAX_INLINE_BYTES:
+                yield self.create_json_message({
+                    "success": False,
+                    "error": f"config is {size} bytes, larger than the {MAX_INLINE_BYTES} bytes inline limit, "
+                             f"use output_mode 'range' or 'blob' instead",
+                    "total_bytes": size
+                })
+                return
+
             yield self.create_json_message({
                 "success": True,
                 "config": config
@@ -3,26 +3,28 @@ from typing import Any
 
 from dify_plugin import Tool
 from dify_plugin.entities.tool import ToolInvokeMessage
-from nacos import NacosClient
+from v2.nacos import ConfigParam
+
+from tools.utils import decode_content, get_config_service, run_async
 
 
 class NacosTool(Tool):
     def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage]:
         # Extract parameters
-        nacos_addr = self.runtime.credentials.get("nacos_addr")
-        username = self.runtime.credentials.get("nacos_username")
-        password = self.runtime.credentials.get("nacos_password")
-        access_key = self.runtime.credentials.get("nacos_accessKey")
-        secret_key = self.runtime.credentials.get("nacos_secretKey")
         namespace_id = str(tool_parameters.get("namespace_id"))
         data_id = str(tool_parameters.get("data_id"))
         group_name = str(tool_parameters.get("group_name"))
-        client = NacosClient(nacos_addr, namespace=namespace_id,
-                             username=username, password=password,
-                             ak=access_key, sk=secret_key)
-        content = str(tool_parameters['content'])
+
+        async def publish_config(content: str) -> bool:
+            config_service = await get_config_service(self.runtime.credentials, namespace_id)
+            return await config_service.publish_config(
+                ConfigParam(data_id=data_id, group=group_name, content=content))
+
         try:
-            publish_result = client.publish_config(data_id=data_id, group=group_name, content=content)
+            content = decode_content(tool_parameters.get("content"),
+                                     tool_parameters.get("content_encoding"),
+                                     tool_parameters.get("content_file"))
+            publish_result = run_async(publish_config(content))
             yield self.create_json_message({
                 "success": True,
                 "result": publish_result
@@ -0,0 +1,306 @@
+import asyncio
+import base64
+import gzip
+import threading
+import time
+import zlib
+from collections.abc import Coroutine, Mapping
+from typing import Any, Optional
+
+from nacos import NacosClient
+from v2.nacos import ClientConfigBuilder, ConfigParam, NacosConfigService
+from v2.nacos.common.nacos_exception import NO_RIGHT, NacosException
+
+# Largest config body accepted by the writer after decompression.
+MAX_CONFIG_BYTES = 10 * 1024 * 1024
+# Largest config body returned inline in a JSON message by the reader.
+MAX_INLINE_BYTES = 512 * 1024
+# Default and upper bound for a single ranged read.
+DEFAULT_RANGE_BYTES = 64 * 1024
+MAX_RANGE_BYTES = 1024 * 1024
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Namespace and config used to probe the server when validating credentials.
+WARM_UP_NAMESPACE_ID = ""
+WARM_UP_DATA_ID = "dify-plugin-credential-probe"
+WARM_UP_GROUP = "DEFAULT_GROUP"
+
+
+def utf8_boundary(data: memoryview, pos: int) -> int:
+    """
+    Move a byte position backwards until it no longer splits a UTF-8 sequence.
+    """
+    while 0 < pos < len(data) and (data[pos] & 0xC0) == 0x80:
+        pos -= 1
+    return pos
+
+
+def read_range(content: bytes, offset: int, max_bytes: int) -> dict[str, Any]:
+    """
+    Slice a config body into a UTF-8 safe byte range.
+
+    Args:
+        content: Encoded config body
+        offset: Start position in bytes, normally the previous next_offset
+        max_bytes: Maximum number of bytes to return
+
+    Returns:
+        Dict with the decoded chunk, its byte range and the offset to continue from
+    """
+    total = len(content)
+    if offset < 0 or offset > total:
+        raise ValueError(f"offset {offset} is out of range, config size is {total} bytes")
+    max_bytes = max(1, min(max_bytes, MAX_RANGE_BYTES))
+
+    view = memoryview(content)
+    start = utf8_boundary(view, offset)
+    end = utf8_boundary(view, min(start + max_bytes, total))
+    if end <= start < total:
+        # A single character wider than max_bytes, return it whole
+        end = start + 1
+        while end < total and (view[end] & 0xC0) == 0x80:
+            end += 1
+
+    return {
+        "config": str(view[start:end], "utf-8"),
+        "offset": start,
+        "next_offset": end,
+        "total_bytes": total,
+        "eof": end >= total,
+    }
+
+
+def decompress_gzip(data: bytes, max_bytes: int = MAX_CONFIG_BYTES) -> bytes:
+    """
+    Inflate gzip data, refusing to expand past max_bytes.
+
+    Concatenated gzip members are inflated in order like gzip -d does,
+    anything else after the last member is rejected.
+    """
+    parts = []
+    size = 0
+    while True:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            result = decompressor.decompress(data, max_bytes - size + 1)
+        except zlib.error as e:
+            raise ValueError(f"gzip content is invalid: {e}")
+        size += len(result)
+        if size > max_bytes or decompressor.unconsumed_tail:
+            raise ValueError(f"decompressed config exceeds the {max_bytes} bytes limit")
+        if not decompressor.eof:
+            raise ValueError("gzip content is truncated")
+        parts.append(result)
+        data = decompressor.unused_data
+        if not data:
+            return b"".join(parts)
+        if data[:2] != GZIP_MAGIC:
+            raise ValueError("unexpected data after the end of the gzip content")
+
+
+def decode_content(content: Optional[str], encoding: Optional[str], file: Any = None) -> str:
+    """
+    Resolve the config body from the writer parameters.
+
+    Args:
+        content: Text content, optionally base64 encoded
+        encoding: One of plain, base64 or gzip_base64
+        file: Optional uploaded file, gzip files are detected by their magic bytes
+
+    Returns:
+        Decoded config body
+    """
+    if file is not None:
+        data = file.blob
+        if len(data) > MAX_CONFIG_BYTES:
+            raise ValueError(f"uploaded file exceeds the {MAX_CONFIG_BYTES} bytes limit")
+        if data[:2] == GZIP_MAGIC:
+            data = decompress_gzip(data)
+    else:
+        if content is None:
+            raise ValueError("either content or content_file is required")
+        encoding = encoding or "plain"
+        if encoding == "plain":
+            data = content.encode("utf-8")
+        elif encoding in ("base64", "gzip_base64"):
+            try:
+                data = base64.b64decode(content, validate=True)
+            except ValueError as e:
+                raise ValueError(f"content is not valid base64: {e}")
+            if encoding == "gzip_base64":
+                data = decompress_gzip(data)
+        else:
+            raise ValueError(f"unsupported content_encoding: {encoding}")
+
+    if len(data) > MAX_CONFIG_BYTES:
+        raise ValueError(f"config content exceeds the {MAX_CONFIG_BYTES} bytes limit")
+    return data.decode("utf-8")
+
+
+def compress_blob(content: bytes) -> bytes:
+    """
+    Gzip a config body for blob output.
+    """
+    return gzip.compress(content, compresslevel=6)
+
+
+# ============== Async runtime ==============
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_config_services: dict[tuple, NacosConfigService] = {}
+_config_services_lock: Optional[asyncio.Lock] = None
+_legacy_clients: dict[tuple, NacosClient] = {}
+_legacy_clients_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the process-wide event loop, starting its thread on first use.
+
+    All tool invocations submit their coroutines to this loop, so config
+    services and their gRPC connections are shared between calls.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="nacos-config-loop", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def run_async(coro: Coroutine, timeout: Optional[float] = None) -> Any:
+    """
+    Run a coroutine on the shared event loop and block until it finishes.
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, _get_loop())
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+        raise
+
+
+def _server_address(nacos_addr: str) -> str:
+    """Append the default port when the address does not carry one."""
+    return ",".join(
+        addr if ':' in addr.split('//')[-1] else f"{addr}:8848"
+        for addr in (a.strip() for a in nacos_addr.split(',')) if addr
+    )
+
+
+def _namespace(namespace_id: Optional[str]) -> str:
+    """Both Nacos 2 and 3 treat the empty namespace as public."""
+    return "" if not namespace_id or namespace_id == "public" else namespace_id
+
+
+def _service_key(credentials: Mapping[str, Any], namespace_id: str) -> tuple:
+    return (
+        credentials.get("nacos_addr"),
+        _namespace(namespace_id),
+        credentials.get("nacos_username"),
+        credentials.get("nacos_password"),
+        credentials.get("nacos_accessKey"),
+        credentials.get("nacos_secretKey"),
+    )
+
+
+async def get_config_service(credentials: Mapping[str, Any], namespace_id: str) -> NacosConfigService:
+    """
+    Get a started NacosConfigService for the credentials and namespace.
+
+    Services are created once per distinct configuration and reused, must be
+    awaited on the loop used by run_async.
+    """
+    global _config_services_lock
+    if _config_services_lock is None:
+        _config_services_lock = asyncio.Lock()
+
+    key = _service_key(credentials, namespace_id)
+    service = _config_services.get(key)
+    if service is not None:
+        return service
+
+    async with _config_services_lock:
+        service = _config_services.get(key)
+        if service is None:
+            client_config = ClientConfigBuilder().server_address(
+                _server_address(credentials.get("nacos_addr") or "")).namespace_id(
+                _namespace(namespace_id)).username(
+                credentials.get("nacos_username")).password(
+                credentials.get("nacos_password")).access_key(
+                credentials.get("nacos_accessKey")).secret_key(
+                credentials.get("nacos_secretKey")).build()
+            service = await NacosConfigService.create_config_service(client_config)
+            _config_services[key] = service
+        return service
+
+
+async def discard_config_service(credentials: Mapping[str, Any], namespace_id: str) -> None:
+    """
+    Drop a cached service and close its connection.
+    """
+    service = _config_services.pop(_service_key(credentials, namespace_id), None)
+    if service is not None:
+        try:
+            await service.shutdown()
+        except Exception:
+            pass
+
+
+async def warm_up_config_service(credentials: Mapping[str, Any],
+                                 namespace_id: str = WARM_UP_NAMESPACE_ID) -> float:
+    """
+    Log in to Nacos and keep the connected config service cached.
+
+    A probe config is read so that authentication errors surface here rather
+    than on the first tool call. The SDK fails a rejected login before the
+    probe is sent, so when credentials are given a permission-denied probe
+    only means they are scoped to other namespaces and counts as a
+    successful login. The service is dropped again if any step fails or the
+    warm-up is cancelled by a timeout.
+
+    Returns:
+        Round-trip time of the warm-up in milliseconds
+    """
+    start = time.perf_counter()
+    succeeded = False
+    try:
+        config_service = await get_config_service(credentials, namespace_id)
+        if not await config_service.server_health():
+            raise ValueError(f"Nacos server {credentials.get('nacos_addr')} is not healthy")
+        try:
+            await config_service.get_config(ConfigParam(data_id=WARM_UP_DATA_ID, group=WARM_UP_GROUP))
+        except NacosException as e:
+            has_credentials = (credentials.get("nacos_username") and credentials.get("nacos_password")) \
+                or (credentials.get("nacos_accessKey") and credentials.get("nacos_secretKey"))
+            if e.error_code != NO_RIGHT or not has_credentials:
+                raise
+        succeeded = True
+    finally:
+        # Also runs when a validation timeout cancels the warm-up
+        if not succeeded:
+            await discard_config_service(credentials, namespace_id)
+    return (time.perf_counter() - start) * 1000
+
+
+def get_legacy_client(credentials: Mapping[str, Any], namespace_id: str) -> NacosClient:
+    """
+    Get a cached HTTP NacosClient for APIs the v2 SDK does not cover, such as
+    config history and paginated search. The client keeps its access token
+    between calls.
+    """
+    key = _service_key(credentials, namespace_id)
+    with _legacy_clients_lock:
+        client = _legacy_clients.get(key)
+        if client is None:
+            client = NacosClient(_server_address(credentials.get("nacos_addr") or ""),
+                                 namespace=_namespace(namespace_id),
+                                 username=credentials.get("nacos_username"),
+                                 password=credentials.get("nacos_password"),
+                                 ak=credentials.get("nacos_accessKey"),
+                                 sk=credentials.get("nacos_secretKey"))
+            _legacy_clients[key] = client
+        return client